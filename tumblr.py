@@ -22,24 +22,145 @@ __TODO__ = """TODO List
 # Note to self:
 # Build using "python setup.py bdist_egg"
 
+# Only modules that parsing needs, and that are cheap to import, are 
+# imported here.  The network stack (httplib2, httplib, socket, urllib 
+# and so on) is loaded by _get_httplib2() once the first Client is made, 
+# and threading and logging by _get_threading() and _get_log(), so that 
+# parsing local XML loads none of them.  Each is imported once into a 
+# module global rather than in the functions that use it: under Python 
+# 2, an import statement in a function takes the global import lock on 
+# every call, and can deadlock a thread that runs while another is 
+# importing.  Optional dependencies (multiprocessing, sqlite3, numpy and 
+# pyarrow) are imported by the function that needs them, which runs once 
+# per call and never in a worker thread.
+import os
+import re
+import copy
+import mmap
+import struct
+import time
 import urlparse
-import httplib2
-from urllib import urlencode
+import hashlib
+import zlib
+import htmlentitydefs
+from array import array
+from operator import attrgetter
+from cStringIO import StringIO
+# The C parser ships with Python 2.5 and later, but builds without it 
+# can make do with the pure Python one.
 try:
     import xml.etree.cElementTree as ElementTree
-except:
-    try:
-        import xml.etree.ElementTree as ElementTree
-    except:
-        try:
-            import cElementTree as ElementTree
-        except:
-            import ElementTree as ElementTree
+except ImportError:
+    import xml.etree.ElementTree as ElementTree
+
+_httplib2 = None
+_httplib = None
+_email_utils = None
+_socket = None
+_random = None
+_urlencode = None
+
+def _get_httplib2():
+    """Returns the httplib2 module, importing it along with the rest of 
+    the network stack (httplib, email.utils, socket, random and 
+    urllib.urlencode) the first time it's needed.
+
+    Client and DiskCache call this when they are made, so the threads
+    that later use them only ever read the module globals."""
+    global _httplib2, _httplib, _email_utils, _socket, _random, _urlencode
+    if _httplib2 is None:
+        import socket
+        import random
+        import httplib
+        import email.utils
+        from urllib import urlencode
+        import httplib2
+        _socket = socket
+        _random = random
+        _httplib = httplib
+        _email_utils = email.utils
+        _urlencode = urlencode
+        _httplib2 = httplib2
+    return _httplib2
+
+def _get_httplib():
+    """Returns the httplib module; see _get_httplib2()."""
+    if _httplib is None:
+        _get_httplib2()
+    return _httplib
+
+def _get_email_utils():
+    """Returns the email.utils module; see _get_httplib2()."""
+    if _email_utils is None:
+        _get_httplib2()
+    return _email_utils
+
+def _get_socket():
+    """Returns the socket module; see _get_httplib2()."""
+    if _socket is None:
+        _get_httplib2()
+    return _socket
+
+def _get_random():
+    """Returns the random module; see _get_httplib2()."""
+    if _random is None:
+        _get_httplib2()
+    return _random
+
+def _get_urlencode():
+    """Returns urllib.urlencode; see _get_httplib2()."""
+    if _urlencode is None:
+        _get_httplib2()
+    return _urlencode
+
+_threading = None
+_Queue = None
+
+def _get_threading():
+    """Returns the threading module, importing it along with Queue the 
+    first time it's needed.  The classes that use threads call this when 
+    they are made."""
+    global _threading, _Queue
+    if _threading is None:
+        import Queue
+        import threading
+        _Queue = Queue
+        _threading = threading
+    return _threading
+
+def _get_queue():
+    """Returns the Queue module; see _get_threading()."""
+    if _Queue is None:
+        _get_threading()
+    return _Queue
+
+_log = None
+
+def _get_log():
+    """Returns the "tumblr" logger, importing logging the first time."""
+    global _log
+    if _log is None:
+        import logging
+        log = logging.getLogger('tumblr')
+        log.addHandler(logging.NullHandler())
+        _log = log
+    return _log
 
 USER_AGENT = "Tumblr in the Bronx/%s +http://labs.spaceshipnofuture.org/tumblrapi/" % __version__
 DEFAULT_HTTP_CACHE_DIR = ".cache"
+# Files are fed to the parser this many bytes at a time
+CHUNK_SIZE = 64 * 1024
+# Responses with these statuses are worth trying again
+RETRY_STATUSES = (429, 500, 503)
+# Only requests with these methods can be sent twice without harm
+RETRY_METHODS = ("GET", "HEAD")
+# Streamed requests follow these redirects, up to MAX_REDIRECTS in a row
+REDIRECT_STATUSES = (301, 302, 303, 307)
+MAX_REDIRECTS = 5
 
 BASE_AUTH_URL = "http://www.tumblr.com/api/authenticate"
+BASE_READ_URL = "http://%s.tumblr.com/api/read"
+MAX_POSTS_PER_PAGE = 50
 
 class TumblrError(Exception): pass
 class TumblrOhShitError(TumblrError): pass
@@ -47,11 +168,14 @@ class TumblrParseError(TumblrError): pass
 class TumblrHTTPError(TumblrError): pass
 class InternalServerError(TumblrHTTPError): pass
 class ServiceUnavailableError(TumblrHTTPError): pass
+class TooManyRequestsError(TumblrHTTPError): pass
 class URLNotFoundError(TumblrHTTPError): pass
 class URLForbiddenError(TumblrHTTPError): pass
 class URLGoneError(TumblrHTTPError): pass
 class UnsupportedContentTypeError(TumblrHTTPError): pass
 class BadContentTypeError(TumblrHTTPError): pass
+class ResponseTooLargeError(TumblrHTTPError): pass
+class TumblrTimeoutError(TumblrError): pass
 
 def _unicode(str):
     """A workaround for Python's built-in unicode().
@@ -66,6 +190,18 @@ def _unicode(str):
     else:
         return unicode(str)
 
+def _alias(name):
+    """Returns a read-only class attribute that reads the named attribute.
+    
+    Reading an alias costs about the same as reading the attribute itself."""
+    return property(attrgetter(name), doc="Alias for %s." % name)
+
+def _isPath(str):
+    """Attempts to determine if the given string is the path of a file 
+    rather than a hunk of XML, which can't help but contain a '<'."""
+    return isinstance(str, basestring) and len(str) < 4096 and \
+        '<' not in str and os.path.isfile(str)
+
 def _isUrl(str):
     """Attempts to determine if the given string is really an HTTP URL.
 
@@ -92,9 +228,13 @@ class TumblrUrl(object):
     @property
     def url(self):
         if len(self.params) > 0:
-                url_params = "&".join([ "=".join(p) \
-                                        for p in self.params.items() ])
-                return self.base_url + "?" + url_params
+            # A query already in the base URL is kept, less any parameters 
+            # that are set again here
+            scheme, netloc, path, query, fragment = urlparse.urlsplit(self.base_url)
+            params = [ (name, value) for name, value in urlparse.parse_qsl(query, True) 
+                       if name not in self.params ]
+            params.extend(self.params.items())
+            return urlparse.urlunsplit((scheme, netloc, path, _get_urlencode()(params), fragment))
         else:
             return self.base_url
                 
@@ -105,9 +245,9 @@ class AuthUrl(TumblrUrl):
     >>> url = tumblr.AuthUrl()
     >>> url.set_email("guido@example.com").set_password("secret").url
     """
-    def __init__(self):
+    def __init__(self, base_url=BASE_AUTH_URL):
         super(AuthUrl, self).__init__()
-        self.base_url = BASE_AUTH_URL
+        self.base_url = base_url
         
     def set_email(self, email):
         self.add_param("email", email)
@@ -121,6 +261,30 @@ class AuthUrl(TumblrUrl):
         if include_theme:
             self.add_param("include_theme", "1")
         return self
+
+
+class ReadUrl(TumblrUrl):
+    """Use this to build a Tumblr read URL for a tumblelog.
+    
+    Accepts either a tumblelog name or the full URL of its read API.
+    
+    >>> url = tumblr.ReadUrl("demo")
+    >>> url.set_start(50).set_num(50).url
+    """
+    def __init__(self, name):
+        super(ReadUrl, self).__init__()
+        if _isUrl(name):
+            self.base_url = name
+        else:
+            self.base_url = BASE_READ_URL % name
+            
+    def set_start(self, start):
+        self.add_param("start", str(start))
+        return self
+        
+    def set_num(self, num):
+        self.add_param("num", str(num))
+        return self
         
 #######################################################################
 #
@@ -128,7 +292,37 @@ class AuthUrl(TumblrUrl):
 #
 #######################################################################
 
-class Feed(object):
+class _Compact(object):
+    """Base class for objects that keep their attributes in __slots__ 
+    instead of a per-instance dict, which matters when there are hundreds 
+    of thousands of them.
+    
+    Adds pickling support, which slotted objects otherwise lack for the 
+    older pickle protocols."""
+    __slots__ = ()
+
+    def _slotnames(cls):
+        names = []
+        for c in cls.__mro__:
+            names.extend(c.__dict__.get('__slots__', ()))
+        return names
+    _slotnames = classmethod(_slotnames)
+
+    def __getstate__(self):
+        state = {}
+        for name in self._slotnames():
+            try:
+                state[name] = object.__getattribute__(self, name)
+            except AttributeError:
+                pass
+        return state
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
+
+
+class Feed(_Compact):
     """A Feed object stores data relating to one of the Tumblelog's 
     source feeds.
     
@@ -139,6 +333,8 @@ class Feed(object):
     - title
     - next_update
     """
+    __slots__ = ('id', 'url', 'type', 'title', 'next_update')
+
     def __init__(self, id, url, type, title, next_update):
         super(Feed, self).__init__()
         self.id = id
@@ -156,6 +352,9 @@ class Tumblelog(object):
     
     Attributes:
     - http_response
+    - etag
+    - last_modified
+    - not_modified
     - name
     - cname
     - url
@@ -179,6 +378,11 @@ class Tumblelog(object):
         #                                        (current is always 200)
         # - http_response.previous.location:    the suggested destination URL
         self.http_response = None
+        # The response's validators, to be handed back to parse() next 
+        # time; see NotModified.
+        self.etag = None
+        self.last_modified = None
+        self.not_modified = False
         # Get tumblelog attributes
         self.title = _unicode(logdata.attrib.get('title'))
         self.name = _unicode(logdata.attrib.get('name'))
@@ -208,7 +412,30 @@ class Tumblelog(object):
             self.feeds = None
 
 
-class Line(object):
+class NotModified(object):
+    """Stands in for a Tumblelog when the server says it hasn't changed.
+    
+    parse() returns one of these, without reading or parsing anything, 
+    when the response matches the etag or last_modified it was given.  
+    Its not_modified attribute is always True, where a Tumblelog's is 
+    always False, so either can be told apart from the other.
+    
+    Attributes:
+    - http_response
+    - etag
+    - last_modified
+    - not_modified
+    """
+    not_modified = True
+
+    def __init__(self, http_response, etag=None, last_modified=None):
+        super(NotModified, self).__init__()
+        self.http_response = http_response
+        self.etag = etag
+        self.last_modified = last_modified
+
+
+class Line(_Compact):
     """A line in a conversation.
     
     Attributes:
@@ -216,6 +443,8 @@ class Line(object):
     - label
     - content
     """
+    __slots__ = ('name', 'label', 'content')
+
     def __init__(self, name, label, content):
         super(Line, self).__init__()
         self.name = name
@@ -223,9 +452,44 @@ class Line(object):
         self.content = content
 
 
-class Post(object):
+def _childText(tag):
+    """Returns a field extractor for the text of one of a post's child 
+    elements.  A missing element gives u''."""
+    def extract(postdata):
+        try:
+            return _unicode(postdata.find(tag).text)
+        except AttributeError:
+            return u''
+    return extract
+
+def _empty(postdata):
+    """Field extractor for fields that aren't parsed yet."""
+    return u''
+
+def _photoUrls(postdata):
+    urls = {}
+    for url in postdata.findall('photo-url'):
+        urls[url.attrib.get('max-width')] = _unicode(url.text)
+    return urls
+
+def _conversationLines(postdata):
+    lines = []
+    for line in postdata.findall('conversation-line'):
+        name = _unicode(line.attrib.get('name'))
+        label = _unicode(line.attrib.get('label'))
+        content = _unicode(line.text)
+        l = Line(name, label, content)
+        lines.append(l)
+    return lines
+
+
+class Post(_Compact):
     """Generic Post object from which the others are derived.
     
+    The fields of each subclass are pulled out of the XML by the 
+    extractors in its _fields map.  A lazy post only does so when a field 
+    is first read, and keeps the value from then on.
+    
     Attributes:
     - type
     - id
@@ -236,14 +500,20 @@ class Post(object):
     - source_feed
     - source_feed_id
     - source_url
+    - postdata
+    
+    Pickled posts leave out their postdata.
     """
-    def __init__(self, postdata):
+    __slots__ = ('type', 'id', 'url', 'date_gmt', 'date', 'unixtime', 
+                 'source_feed', 'source_feed_id', 'source_url', 'postdata')
+    # Aliases for instance attributes are class attributes, so that 
+    # reading them is as fast as reading any other attribute.
+    permalink = _alias('url')
+    # Maps the name of each subclass field to its extractor
+    _fields = {}
+
+    def __init__(self, postdata, lazy=False):
         super(Post, self).__init__()
-        # The keymap is a set of aliases for instance attributes.
-        # See Post.__getattr__() below.
-        self._keymap = {
-            'permalink': 'url'
-        }
         # Setting a type is admittedly silly because 
         # the type is implied by the object class
         self.type = 'unknown'
@@ -260,18 +530,37 @@ class Post(object):
             self.source_feed_id = None
             self.source_url = None
         # Copy the reference for the postdata tree into an instance attribute 
-        # so that it can be inspected for whatever weird reason
+        # so that it can be inspected for whatever weird reason.
+        # parse(keep_postdata=False) sets this to None, except for lazy 
+        # posts, which need it to read their fields.
         self.postdata = postdata
+        if not lazy:
+            for name, extract in self._fields.items():
+                setattr(self, name, extract(postdata))
+
+    def __getstate__(self):
+        # Posts are pickled without their XML, which is bulky and can't 
+        # always be pickled anyway, so lazy fields have to be read first.
+        for name in self._fields:
+            getattr(self, name)
+        state = super(Post, self).__getstate__()
+        state.pop('postdata', None)
+        return state
+
+    def __setstate__(self, state):
+        self.postdata = None
+        super(Post, self).__setstate__(state)
 
     def __getattr__(self, attr):
+        # Only called when an attribute hasn't been set, which for a lazy 
+        # post's fields means that they haven't been read yet.
         try:
-            return self.__dict__[attr]
+            extract = self._fields[attr]
         except KeyError:
-            pass
-        try:
-            return self.__dict__[self._keymap[attr]]
-        except:
             raise AttributeError, "object has no attribute '%s'" % attr
+        value = extract(self.postdata)
+        setattr(self, attr, value)
+        return value
 
 
 class Regular(Post):
@@ -284,19 +573,16 @@ class Regular(Post):
     
     See also the Post object.
     """
-    def __init__(self, postdata):
-        super(Regular, self).__init__(postdata)
+    __slots__ = ('title', 'body')
+    content = description = _alias('body')
+    _fields = {
+        'title': _childText('regular-title'),
+        'body': _childText('regular-body')
+    }
+
+    def __init__(self, postdata, lazy=False):
+        super(Regular, self).__init__(postdata, lazy)
         self.type = 'regular'
-        try:
-            self.title = _unicode(postdata.find('regular-title').text)
-        except AttributeError:
-            self.title = u''
-        try:
-            self.body = _unicode(postdata.find('regular-body').text)
-        except AttributeError:
-            self.body = u''
-        self._keymap['content'] = 'body'
-        self._keymap['description'] = 'body'
 
 
 class Link(Post):
@@ -310,25 +596,19 @@ class Link(Post):
     
     See also the Post object.
     """
-    def __init__(self, postdata):
-        super(Link, self).__init__(postdata)
+    __slots__ = ('title', 'description', 'link_url', 'via')
+    body = content = _alias('description')
+    related = _alias('link_url')
+    _fields = {
+        'title': _childText('link-text'),
+        'description': _childText('link-description'),
+        'link_url': _childText('link-url'),
+        'via': _empty # TODO: Possibly extract 'via' link from description
+    }
+
+    def __init__(self, postdata, lazy=False):
+        super(Link, self).__init__(postdata, lazy)
         self.type = 'link'
-        try:
-            self.title = _unicode(postdata.find('link-text').text)
-        except AttributeError:
-            self.title = u''
-        try:
-            self.description = _unicode(postdata.find('link-description').text)
-        except AttributeError:
-            self.description = u''
-        try:
-            self.link_url = _unicode(postdata.find('link-url').text)
-        except AttributeError:
-            self.link_url = u''
-        self.via = u'' # TODO: Possibly extract 'via' link from description
-        self._keymap['body'] = 'description'
-        self._keymap['content'] = 'description'
-        self._keymap['related'] = 'link_url'
 
 
 class Quote(Post):
@@ -339,20 +619,16 @@ class Quote(Post):
     - quote/description/body/content
     - source
     """
-    def __init__(self, postdata):
-        super(Quote, self).__init__(postdata)
+    __slots__ = ('quote', 'source')
+    description = body = content = _alias('quote')
+    _fields = {
+        'quote': _childText('quote-text'),
+        'source': _childText('quote-source')
+    }
+
+    def __init__(self, postdata, lazy=False):
+        super(Quote, self).__init__(postdata, lazy)
         self.type = 'quote'
-        try:
-            self.quote = _unicode(postdata.find('quote-text').text)
-        except AttributeError:
-            self.quote = u''
-        try:
-            self.source = _unicode(postdata.find('quote-source').text)
-        except AttributeError:
-            self.source = u''
-        self._keymap['description'] = 'quote'
-        self._keymap['body'] = 'quote'
-        self._keymap['content'] = 'quote'
 
 
 class Photo(Post):
@@ -365,19 +641,16 @@ class Photo(Post):
     
     See also the Post object.
     """
-    def __init__(self, postdata):
-        super(Photo, self).__init__(postdata)
+    __slots__ = ('caption', 'urls')
+    body = content = description = _alias('caption')
+    _fields = {
+        'caption': _childText('photo-caption'),
+        'urls': _photoUrls
+    }
+
+    def __init__(self, postdata, lazy=False):
+        super(Photo, self).__init__(postdata, lazy)
         self.type = 'photo'
-        try:
-            self.caption = _unicode(postdata.find('photo-caption').text)
-        except AttributeError:
-            self.caption = u''
-        self.urls = {}
-        for url in postdata.findall('photo-url'):
-            self.urls[url.attrib.get('max-width')] = _unicode(url.text)
-        self._keymap['body'] = 'caption'
-        self._keymap['content'] = 'caption'
-        self._keymap['description'] = 'caption'
 
 
 class Conversation(Post):
@@ -390,19 +663,16 @@ class Conversation(Post):
     
     See also the Post object.
     """
-    def __init__(self, postdata):
-        super(Conversation, self).__init__(postdata)
+    __slots__ = ('description', 'lines')
+    body = content = _alias('description')
+    _fields = {
+        'description': lambda postdata: postdata.find('conversation-text').text,
+        'lines': _conversationLines
+    }
+
+    def __init__(self, postdata, lazy=False):
+        super(Conversation, self).__init__(postdata, lazy)
         self.type = 'conversation'
-        self.description = postdata.find('conversation-text').text
-        self.lines = []
-        for line in postdata.findall('conversation-line'):
-            name = _unicode(line.attrib.get('name'))
-            label = _unicode(line.attrib.get('label'))
-            content = _unicode(line.text)
-            l = Line(name, label, content)
-            self.lines.append(l)
-        self._keymap['body'] = 'description'
-        self._keymap['content'] = 'description'
 
 
 class Video(Post):
@@ -417,26 +687,19 @@ class Video(Post):
     
     See also the Post object.
     """
-    def __init__(self, postdata):
-        super(Video, self).__init__(postdata)
-        self.type = 'video'
-        try:
-            self.source = _unicode(postdata.find('video-source').text)
-        except AttributeError:
-            self.source = u''
-        try:
-            self.player = _unicode(postdata.find('video-player').text)
-        except AttributeError:
-            self.player = u''
-        try:
-            self.caption = _unicode(postdata.find('video-caption').text)
-        except AttributeError:
-            self.caption = u''
+    __slots__ = ('source', 'player', 'caption', 'title')
+    body = content = description = _alias('caption')
+    _fields = {
+        'source': _childText('video-source'),
+        'player': _childText('video-player'),
+        'caption': _childText('video-caption'),
         # Only Vimeo videos have titles
-        self.title = u''
-        self._keymap['body'] = 'caption'
-        self._keymap['content'] = 'caption'
-        self._keymap['description'] = 'caption'
+        'title': _empty
+    }
+
+    def __init__(self, postdata, lazy=False):
+        super(Video, self).__init__(postdata, lazy)
+        self.type = 'video'
 
 
 class Audio(Post):
@@ -449,14 +712,39 @@ class Audio(Post):
     
     See also the Post object.
     """
-    def __init__(self, postdata):
-        super(Audio, self).__init__(postdata)
+    __slots__ = ('player', 'caption')
+    body = content = description = _alias('caption')
+    _fields = {
+        'player': _empty,
+        'caption': _empty
+    }
+
+    def __init__(self, postdata, lazy=False):
+        super(Audio, self).__init__(postdata, lazy)
         self.type = 'audio'
-        self.player = u''
-        self.caption = u''
-        self._keymap['body'] = 'caption'
-        self._keymap['content'] = 'caption'
-        self._keymap['description'] = 'caption'        
+
+
+# Maps each post type to the constructor used for its posts.  Posts of a 
+# type that isn't listed here become plain Post objects.
+POST_TYPES = {
+    'regular': Regular,
+    'link': Link,
+    'quote': Quote,
+    'photo': Photo,
+    'conversation': Conversation,
+    'video': Video,
+    'audio': Audio
+}
+
+def register_post_type(type, constructor):
+    """Sets the constructor used for posts of the given type.
+    
+    The constructor is called with the post's XML element and the lazy 
+    flag given to parse(), and may return any object with the attributes 
+    of a Post.  This can be used to add new post types or to replace the 
+    built-in classes with cheaper ones.
+    """
+    POST_TYPES[type] = constructor
 
 #######################################################################
 #
@@ -503,6 +791,246 @@ class TumblelogAuthInfo(object):
         # TODO: description, custom-css, theme-source
         
 
+#######################################################################
+#
+# Caches
+#
+# Any of these can be handed to a Client in place of a cache directory.
+# They all follow the httplib2 cache interface of get(), set() and 
+# delete().
+#
+#######################################################################
+
+class NoCache(object):
+    """A cache that never stores anything."""
+    def get(self, key):
+        return None
+
+    def set(self, key, value):
+        pass
+
+    def delete(self, key):
+        pass
+
+
+class MemoryCache(object):
+    """A bounded in-memory cache.
+    
+    Once it holds max_entries entries, the least recently used one is 
+    dropped to make room for the next.  If ttl is given, entries also 
+    expire that many seconds after they were stored.  A MemoryCache can 
+    be shared by several threads.
+    
+    >>> client = tumblr.Client(cache=tumblr.MemoryCache(1000, ttl=300))
+    """
+    def __init__(self, max_entries=1000, ttl=None):
+        super(MemoryCache, self).__init__()
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = _get_threading().Lock()
+        # Entries are [prev, next, key, value, expires] lists in a circular 
+        # doubly-linked list, most recently used first.
+        self._entries = {}
+        self._root = [ None, None, None, None, None ]
+        self._root[0] = self._root[1] = self._root
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _unlink(self, entry):
+        entry[0][1] = entry[1]
+        entry[1][0] = entry[0]
+
+    def _linkFirst(self, entry):
+        root = self._root
+        entry[0] = root
+        entry[1] = root[1]
+        root[1][0] = entry
+        root[1] = entry
+
+    def get(self, key):
+        self._lock.acquire()
+        try:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[4] is not None and entry[4] < time.time():
+                self._unlink(entry)
+                del self._entries[key]
+                return None
+            self._unlink(entry)
+            self._linkFirst(entry)
+            return entry[3]
+        finally:
+            self._lock.release()
+
+    def set(self, key, value):
+        if self.ttl is None:
+            expires = None
+        else:
+            expires = time.time() + self.ttl
+        self._lock.acquire()
+        try:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._unlink(entry)
+            entry = [ None, None, key, value, expires ]
+            self._entries[key] = entry
+            self._linkFirst(entry)
+            while len(self._entries) > self.max_entries:
+                oldest = self._root[0]
+                self._unlink(oldest)
+                del self._entries[oldest[2]]
+        finally:
+            self._lock.release()
+
+    def delete(self, key):
+        self._lock.acquire()
+        try:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._unlink(entry)
+        finally:
+            self._lock.release()
+
+
+class DiskCache(object):
+    """A cache directory that never grows past max_bytes.
+    
+    When storing an entry takes the directory over its limit, the least 
+    recently used entries are deleted until it fits again.  Unlike a 
+    plain cache directory, a DiskCache can be shared by several threads.
+    
+    >>> client = tumblr.Client(cache=tumblr.DiskCache(".cache", 50 * 1024 * 1024))
+    """
+    def __init__(self, directory, max_bytes=100 * 1024 * 1024):
+        super(DiskCache, self).__init__()
+        _get_httplib2()
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = _get_threading().Lock()
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        self._size = 0
+        for name in os.listdir(directory):
+            path = os.path.join(directory, name)
+            if os.path.isfile(path):
+                self._size += os.path.getsize(path)
+
+    def _path(self, key):
+        return os.path.join(self.directory, _get_httplib2().safename(key))
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            f = open(path, 'rb')
+            try:
+                value = f.read()
+            finally:
+                f.close()
+            # The modification time doubles as the last use
+            os.utime(path, None)
+        except (IOError, OSError):
+            return None
+        return value
+
+    def set(self, key, value):
+        path = self._path(key)
+        self._lock.acquire()
+        try:
+            self._remove(path)
+            f = open(path, 'wb')
+            try:
+                f.write(value)
+            finally:
+                f.close()
+            self._size += len(value)
+            if self._size > self.max_bytes:
+                self._evict()
+        finally:
+            self._lock.release()
+
+    def delete(self, key):
+        self._lock.acquire()
+        try:
+            self._remove(self._path(key))
+        finally:
+            self._lock.release()
+
+    def _remove(self, path):
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+        except OSError:
+            return
+        self._size -= size
+
+    def _evict(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                entries.append((os.path.getmtime(path), path))
+            except OSError:
+                pass
+        entries.sort()
+        for mtime, path in entries:
+            if self._size <= self.max_bytes:
+                break
+            self._remove(path)
+
+#######################################################################
+#
+# Instrumentation
+#
+# Listeners added with add_listener() are called as listener(event, data) 
+# at each stage of fetching and parsing, where data is a dict:
+#
+# - connect   host, seconds: opening a streamed request's connection
+# - fetch     url, status, seconds, bytes, fromcache, stream: an HTTP 
+#             request, up to the end of the body, or for a streamed 
+#             request up to the headers (bytes is then None)
+# - body      bytes, seconds: a streamed response body, once closed
+# - cache     key, hit: a parse cache lookup
+# - tree      seconds: building the element tree
+# - posts     counts, seconds: building posts; counts maps each post 
+#             type to the number built.  For iterparse(), seconds runs 
+#             from start to finish, the caller's own time included
+# - parse     url, seconds, hit: a whole parse() call; url is None 
+#             unless a URL was parsed, and hit is True if nothing had to 
+#             be parsed, as the parse cache held the result or the 
+#             server answered 304 Not Modified
+#
+# Nothing is timed or counted while there are no listeners.  Errors 
+# raised by listeners are logged to the "tumblr" logger and otherwise 
+# ignored.
+#
+#######################################################################
+
+# Replaced rather than modified, so that it can be read without a lock
+_listeners = []
+
+
+def add_listener(listener):
+    """Starts calling listener(event, data) for instrumentation events."""
+    global _listeners
+    # Listener errors are logged, possibly from other threads
+    _get_log()
+    _listeners = _listeners + [ listener ]
+
+def remove_listener(listener):
+    """Stops calling a listener added with add_listener()."""
+    global _listeners
+    _listeners = [ l for l in _listeners if l is not listener ]
+
+def _emit(event, data):
+    for listener in _listeners:
+        try:
+            listener(event, data)
+        except Exception:
+            # A broken listener mustn't stop the work it's watching
+            _get_log().exception("Listener %r failed on the %s event", listener, event)
+
 #######################################################################
 #
 # Action Methods
@@ -522,25 +1050,567 @@ def _parse_content_type(ct):
         charset = None
     return content_type, charset
 
-def _fetch(url, http_method="GET", form_data=None, cache_dir=DEFAULT_HTTP_CACHE_DIR, proxy_info=None):
+class AsyncResult(object):
+    """The eventual result of a call running in the background.
+    
+    If a callback was given, it is called with this AsyncResult once the 
+    call has finished, and wait() and get() only return once the callback 
+    has too.  Within the callback itself, they return straight away.
+    
+    >>> result = client.parse_async("http://demo.tumblr.com/api/read")
+    >>> log = result.get()
+    """
+    def __init__(self, callback=None):
+        super(AsyncResult, self).__init__()
+        self.callback = callback
+        self._event = _get_threading().Event()
+        self._value = None
+        self._error = None
+        self._calling = None
+
+    def _set(self, value, error):
+        self._value = value
+        self._error = error
+        try:
+            if self.callback is not None:
+                self._calling = _get_threading().currentThread()
+                try:
+                    self.callback(self)
+                finally:
+                    self._calling = None
+        finally:
+            self._event.set()
+
+    def ready(self):
+        """Returns True if the call has finished."""
+        return self._event.isSet()
+
+    def wait(self, timeout=None):
+        """Waits for the call to finish.  Returns True if it has."""
+        if self._calling is _get_threading().currentThread():
+            # The callback is reading the result
+            return True
+        self._event.wait(timeout)
+        return self._event.isSet()
+
+    def get(self, timeout=None):
+        """Returns the value of the call, waiting for it if need be.
+        
+        If the call raised an exception, it is raised again here."""
+        if not self.wait(timeout):
+            raise TumblrTimeoutError, "Timed out waiting for a result"
+        if self._error is not None:
+            raise self._error
+        return self._value
+
+
+class _WorkerPool(object):
+    """A fixed number of threads working through a queue of calls.
+    
+    The threads are started with the first call."""
+    def __init__(self, workers):
+        super(_WorkerPool, self).__init__()
+        self.workers = workers
+        threading = _get_threading()
+        self._tasks = _get_queue().Queue()
+        self._threads = []
+        self._lock = threading.Lock()
+        # Failing callbacks are logged from the worker threads
+        _get_log()
+
+    def submit(self, func, args, callback=None):
+        result = AsyncResult(callback)
+        self._lock.acquire()
+        try:
+            while len(self._threads) < self.workers:
+                t = _get_threading().Thread(target=self._work)
+                t.setDaemon(True)
+                t.start()
+                self._threads.append(t)
+        finally:
+            self._lock.release()
+        self._tasks.put((result, func, args))
+        return result
+
+    def _work(self):
+        while True:
+            result, func, args = self._tasks.get()
+            try:
+                value, error = func(*args), None
+            except Exception, e:
+                value, error = None, e
+            try:
+                result._set(value, error)
+            except Exception:
+                # A failing callback must not take the worker down with it
+                _get_log().exception("Callback %r failed", result.callback)
+
+
+def _retryAfter(resp):
+    """Returns the number of seconds a response's Retry-After header asks 
+    to wait, or None if there's no usable header."""
+    value = resp.get('retry-after')
+    if value is None:
+        return None
+    try:
+        return max(0, int(value))
+    except ValueError:
+        pass
+    email_utils = _get_email_utils()
+    date = email_utils.parsedate_tz(value)
+    if date is None:
+        return None
+    return max(0, email_utils.mktime_tz(date) - time.time())
+
+
+class RateLimiter(object):
+    """Limits the rate of requests to each host with a token bucket.
+    
+    Up to burst requests can be made to a host straight away; after that 
+    they are spaced out to rate requests per second.  One RateLimiter can 
+    be shared by several Clients to hold all of them to a single rate.
+    
+    >>> client = tumblr.Client(rate_limiter=tumblr.RateLimiter(5))
+    """
+    def __init__(self, rate, burst=1):
+        super(RateLimiter, self).__init__()
+        self.rate = float(rate)
+        self.burst = burst
+        self._lock = _get_threading().Lock()
+        # Maps each host to its [tokens, time of last update]
+        self._buckets = {}
+
+    def acquire(self, host):
+        """Waits until a request may be made to the given host."""
+        self._lock.acquire()
+        try:
+            now = time.time()
+            bucket = self._buckets.get(host)
+            if bucket is None:
+                bucket = [ self.burst, now ]
+                self._buckets[host] = bucket
+            tokens = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            # Take the token now, even if it means going into debt; the 
+            # wait below pays the debt off, and keeps callers in order.
+            bucket[0] = tokens - 1
+            bucket[1] = now
+        finally:
+            self._lock.release()
+        if tokens < 1:
+            time.sleep((1 - tokens) / self.rate)
+
+
+class _LimitedReader(object):
+    """Reads a streamed HTTP response body, giving up with an error as 
+    soon as it grows past max_bytes or the deadline passes.
+    
+    Only the bytes actually read count towards max_bytes, so a caller 
+    that needs just the start of a large response can still have it.  
+    Closing the reader closes the connection, so a caller that has read 
+    all it needs can stop there without downloading the rest."""
+    def __init__(self, conn, response, max_bytes=None, deadline=None, release=None):
+        super(_LimitedReader, self).__init__()
+        self._started = _listeners and time.time()
+        self.conn = conn
+        self.response = response
+        self.max_bytes = max_bytes
+        self.deadline = deadline
+        self.bytes_read = 0
+        self._release = release
+
+    def read(self, size=-1):
+        if self.deadline is not None and time.time() > self.deadline:
+            self.close()
+            raise TumblrTimeoutError, "Timed out reading the response"
+        if self.max_bytes is not None and (size is None or size < 0):
+            # Reading one byte past the limit tells whether it was passed
+            size = self.max_bytes - self.bytes_read + 1
+        try:
+            if size is None or size < 0:
+                data = self.response.read()
+            else:
+                data = self.response.read(size)
+        except _get_socket().timeout:
+            self.close()
+            raise TumblrTimeoutError, "Timed out reading the response"
+        self.bytes_read += len(data)
+        if self.max_bytes is not None and self.bytes_read > self.max_bytes:
+            self.close()
+            raise ResponseTooLargeError, "Response is over the limit of %d bytes" % self.max_bytes
+        return data
+
+    def close(self):
+        if self.conn is None:
+            return
+        self.response.close()
+        self.conn.close()
+        self.conn = None
+        if self._release is not None:
+            self._release()
+        if self._started:
+            _emit('body', { 'bytes': self.bytes_read, 'seconds': time.time() - self._started })
+
+
+def _limitedConnectionTypes(max_bytes):
+    """Returns httplib2 connection classes, by URL scheme, whose responses 
+    raise ResponseTooLargeError as soon as more than max_bytes of the 
+    body has been read, rather than once all of it has."""
+    httplib2 = _get_httplib2()
+    httplib = _get_httplib()
+
+    class LimitedResponse(httplib.HTTPResponse):
+        bytes_read = 0
+
+        def read(self, amt=None):
+            if self.length is not None and self.bytes_read + self.length > max_bytes:
+                # The Content-Length says it's too large already
+                self.close()
+                raise ResponseTooLargeError, "Response is over the limit of %d bytes" % max_bytes
+            if amt is None:
+                # httplib2 reads the whole body at once; read it a chunk 
+                # at a time so the limit is checked as it comes in
+                chunks = []
+                while True:
+                    # Reading one byte past the limit tells whether it was passed
+                    chunk = self.read(min(CHUNK_SIZE, max_bytes - self.bytes_read + 1))
+                    if not chunk:
+                        return ''.join(chunks)
+                    chunks.append(chunk)
+            data = httplib.HTTPResponse.read(self, amt)
+            self.bytes_read += len(data)
+            if self.bytes_read > max_bytes:
+                self.close()
+                raise ResponseTooLargeError, "Response is over the limit of %d bytes" % max_bytes
+            return data
+
+    class HTTPConnection(httplib2.HTTPConnectionWithTimeout):
+        response_class = LimitedResponse
+
+    class HTTPSConnection(httplib2.HTTPSConnectionWithTimeout):
+        response_class = LimitedResponse
+
+    return { 'http': HTTPConnection, 'https': HTTPSConnection }
+
+
+class Client(object):
+    """A reusable HTTP client for the Tumblr API.
+    
+    A Client holds on to its connections between requests, so repeated 
+    requests to the same host reuse a kept-alive connection rather than 
+    opening a new one every time.  Each thread gets its own connections, 
+    so a single Client can be shared by several threads.
+    
+    The cache may be a directory name, one of the caches above (NoCache, 
+    MemoryCache or DiskCache), any other httplib2-compatible cache, or 
+    None for no caching at all.  A separate parse_cache, usually a 
+    MemoryCache, keeps parsed results; see parse().
+    
+    If max_per_host is set, no more than that many requests are made to 
+    any one host at the same time, however many threads share the Client.
+    
+    The *_async() methods run in the background on a pool of up to 
+    workers threads and return an AsyncResult straight away, so any 
+    number of calls can be in flight at once.
+    
+    GET and HEAD requests answered with 429, 500 or 503 are tried up to 
+    retries more times.  Before each retry the Client waits as long as 
+    the response's Retry-After header asks, or otherwise for a random 
+    time of up to backoff seconds, doubling with each attempt, but never 
+    longer than max_backoff seconds.  If Retry-After asks for a longer 
+    wait than that, the response is returned without a retry.  A 
+    rate_limiter (see RateLimiter) paces the requests to each host, 
+    retries included.
+    
+    A request taking longer than timeout seconds raises a 
+    TumblrTimeoutError, and a response of more than max_bytes raises a 
+    ResponseTooLargeError as soon as that much has been read.  Streamed 
+    requests (see stream()) also check the timeout as the body is read.
+    
+    >>> client = tumblr.Client()
+    >>> log = client.parse("http://demo.tumblr.com/api/read")
+    >>> resp, authinfo = tumblr.authenticate(email, password, client=client)
+    
+    Attributes:
+    - cache
+    - proxy_info
+    - max_per_host
+    - parse_cache
+    - retries
+    - backoff
+    - max_backoff
+    - rate_limiter
+    - timeout
+    - max_bytes
+    """
+    def __init__(self, cache=DEFAULT_HTTP_CACHE_DIR, proxy_info=None, max_per_host=None, workers=8, parse_cache=None, 
+                 retries=0, backoff=0.5, max_backoff=60, rate_limiter=None, timeout=None, max_bytes=None):
+        super(Client, self).__init__()
+        httplib2 = _get_httplib2()
+        # A cache directory is opened once here and shared by every 
+        # connection, rather than being re-opened for each request.
+        if isinstance(cache, basestring):
+            cache = httplib2.FileCache(cache)
+        self.cache = cache
+        self.proxy_info = proxy_info
+        self.max_per_host = max_per_host
+        self.parse_cache = parse_cache
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.rate_limiter = rate_limiter
+        self.timeout = timeout
+        self.max_bytes = max_bytes
+        self._connection_types = {}
+        if max_bytes is not None:
+            self._connection_types = _limitedConnectionTypes(max_bytes)
+        threading = _get_threading()
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._hosts = {}
+        self._pool = _WorkerPool(workers)
+
+    def _http(self):
+        """Returns the calling thread's httplib2.Http object, which keeps 
+        one persistent connection per host."""
+        try:
+            return self._local.http
+        except AttributeError:
+            h = _get_httplib2().Http(cache=self.cache, proxy_info=self.proxy_info, timeout=self.timeout)
+            self._local.http = h
+            return h
+
+    def _hostSemaphore(self, url):
+        """Returns the semaphore limiting concurrent requests to the host 
+        of the given URL."""
+        host = urlparse.urlparse(url)[1]
+        self._lock.acquire()
+        try:
+            semaphore = self._hosts.get(host)
+            if semaphore is None:
+                semaphore = _get_threading().BoundedSemaphore(self.max_per_host)
+                self._hosts[host] = semaphore
+        finally:
+            self._lock.release()
+        return semaphore
+
+    def _retryDelay(self, attempt, resp):
+        """Returns how long to wait before retrying a failed request, or 
+        None if the server asked for a wait longer than max_backoff."""
+        delay = _retryAfter(resp)
+        if delay is not None:
+            # Retrying any sooner than the server asked would be no use
+            if delay > self.max_backoff:
+                return None
+            return delay
+        # "Full jitter" keeps clients that failed together from all 
+        # coming back at the same moment
+        return min(_get_random().uniform(0, self.backoff * (2 ** attempt)), self.max_backoff)
+
+    def _retrying(self, send, url, http_method, body, headers):
+        """Sends a request with send(), trying again as many times as 
+        the Client allows."""
+        attempt = 0
+        while True:
+            resp, content = send(url, http_method, body, headers)
+            if resp.status not in RETRY_STATUSES or attempt >= self.retries or \
+               http_method not in RETRY_METHODS:
+                return resp, content
+            delay = self._retryDelay(attempt, resp)
+            if delay is None:
+                return resp, content
+            if hasattr(content, 'close'):
+                content.close()
+            time.sleep(delay)
+            attempt += 1
+
+    def _request(self, url, http_method, body, headers):
+        scheme, host = urlparse.urlparse(url)[:2]
+        if self.rate_limiter is not None:
+            self.rate_limiter.acquire(host)
+        semaphore = None
+        if self.max_per_host is not None:
+            semaphore = self._hostSemaphore(url)
+            semaphore.acquire()
+        try:
+            try:
+                return self._http().request(url, method=http_method, body=body, headers=headers, 
+                                            connection_type=self._connection_types.get(scheme))
+            except _get_socket().timeout:
+                raise TumblrTimeoutError, "Timed out requesting %s" % url
+            except ResponseTooLargeError:
+                # The rest of the body is still waiting on the connection
+                self._http().close()
+                raise
+        finally:
+            if semaphore is not None:
+                semaphore.release()
+
+    def request(self, url, http_method="GET", body=None, headers=None):
+        """Performs an HTTP request, retrying it if need be, and returns an 
+        httplib2 Response object and the content."""
+        resp, content = self._retrying(self._request, url, http_method, body, headers)
+        # Responses from the HTTP cache, or decompressed ones, aren't 
+        # checked as they are read
+        if self.max_bytes is not None and len(content) > self.max_bytes:
+            raise ResponseTooLargeError, "Response is over the limit of %d bytes" % self.max_bytes
+        return resp, content
+
+    def _open(self, url, http_method, body, headers, deadline):
+        """Sends a request on a connection of its own and returns the 
+        connection and the httplib response, with the body unread."""
+        httplib = _get_httplib()
+        socket = _get_socket()
+        scheme, netloc, path, params, query, fragment = urlparse.urlparse(url)
+        if scheme == 'https':
+            conn = httplib.HTTPSConnection(netloc, timeout=self.timeout)
+        else:
+            conn = httplib.HTTPConnection(netloc, timeout=self.timeout)
+        path = urlparse.urlunparse(('', '', path or '/', params, query, ''))
+        try:
+            if deadline is not None and time.time() > deadline:
+                raise socket.timeout
+            started = _listeners and time.time()
+            conn.connect()
+            if started:
+                _emit('connect', { 'host': netloc, 'seconds': time.time() - started })
+            conn.request(http_method, path, body, headers or {})
+            return conn, conn.getresponse()
+        except socket.timeout:
+            conn.close()
+            raise TumblrTimeoutError, "Timed out requesting %s" % url
+        except:
+            conn.close()
+            raise
+
+    def _stream(self, url, http_method, body, headers):
+        deadline = None
+        if self.timeout is not None:
+            deadline = time.time() + self.timeout
+        previous = None
+        for redirect in range(MAX_REDIRECTS + 1):
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire(urlparse.urlparse(url)[1])
+            release = None
+            if self.max_per_host is not None:
+                # The host's slot is held until the body has been read
+                semaphore = self._hostSemaphore(url)
+                semaphore.acquire()
+                release = semaphore.release
+            try:
+                conn, response = self._open(url, http_method, body, headers, deadline)
+            except:
+                if release is not None:
+                    release()
+                raise
+            resp = _get_httplib2().Response(response)
+            resp.previous = previous
+            # As httplib2 does, record where the content really came from
+            resp.setdefault('content-location', url)
+            reader = _LimitedReader(conn, response, self.max_bytes, deadline, release)
+            if resp.status not in REDIRECT_STATUSES or 'location' not in resp or \
+               http_method not in ("GET", "HEAD"):
+                return resp, reader
+            reader.close()
+            previous = resp
+            url = urlparse.urljoin(url, resp['location'])
+        raise TumblrHTTPError, "Too many redirects"
+
+    def stream(self, url, http_method="GET", body=None, headers=None):
+        """Performs an HTTP request, retrying it if need be, but doesn't 
+        read the body.  Returns an httplib2 Response object and a 
+        file-like object for reading the content a chunk at a time, 
+        which the caller must close.
+        
+        Redirects of GET requests are followed.  Streamed requests don't 
+        go through the HTTP cache or proxy_info."""
+        return self._retrying(self._stream, url, http_method, body, headers)
+
+    def close(self):
+        """Closes the calling thread's kept-alive connections."""
+        h = getattr(self._local, 'http', None)
+        if h is not None:
+            for conn in h.connections.values():
+                conn.close()
+            h.connections.clear()
+
+    def parse(self, url_or_file, **kwargs):
+        """Parses Tumblr API XML using this client.  See parse()."""
+        return parse(url_or_file, client=self, **kwargs)
+
+    def iterparse(self, url_or_file, **kwargs):
+        """Incrementally parses Tumblr API XML using this client.  
+        See iterparse()."""
+        return iterparse(url_or_file, client=self, **kwargs)
+
+    def authenticate(self, email, password, include_theme=False, **kwargs):
+        """Authenticates to the Tumblr API service using this client.  
+        See authenticate()."""
+        return authenticate(email, password, include_theme, client=self, **kwargs)
+
+    def parse_async(self, url_or_file, callback=None, **kwargs):
+        """Parses Tumblr API XML in the background.  Returns an 
+        AsyncResult whose value is the Tumblelog."""
+        return self._pool.submit(lambda: self.parse(url_or_file, **kwargs), (), callback)
+
+    def authenticate_async(self, email, password, include_theme=False, callback=None, **kwargs):
+        """Authenticates in the background.  Returns an AsyncResult whose 
+        value is the (response, AuthInfo) tuple."""
+        return self._pool.submit(lambda: self.authenticate(email, password, include_theme, **kwargs), (), callback)
+
+
+def _fetch(url, http_method="GET", form_data=None, cache_dir=DEFAULT_HTTP_CACHE_DIR, proxy_info=None, client=None, headers=None, stream=False):
     """Requests the Tumblr API URL and deals with any HTTP-related errors.
     
-    Returns both an httplib2 Response object and the content."""
-    valid_content_types = [ 'application/xml', 'text/xml' ]
-    h = httplib2.Http(cache=cache_dir, proxy_info=proxy_info)
+    If no Client is given, a new one is used for this request only.  Any 
+    headers given are sent along with the User-Agent.
+    
+    Returns both an httplib2 Response object and the content.  A 304 Not 
+    Modified response is returned as it is, with empty content.  If 
+    stream is True, the content is a file-like object to be read as the 
+    body comes in, and closed by the caller; a Client with proxy_info 
+    set reads the body whole instead."""
+    if client is None:
+        client = Client(cache_dir, proxy_info)
     try:
         if form_data is not None:
             if not isinstance(form_data, type(dict())):
                 raise TypeError("form_data must be a dictionary!")
-            req_body = urlencode(form_data)
+            req_body = _get_urlencode()(form_data)
         else:
             req_body = None
-        resp, content = h.request(url, method=http_method, body=req_body, headers={ "User-Agent": USER_AGENT })
+        req_headers = { "User-Agent": USER_AGENT }
+        if headers:
+            req_headers.update(headers)
+        stream = stream and client.proxy_info is None
+        started = _listeners and time.time()
+        if stream:
+            resp, content = client.stream(url, http_method, req_body, req_headers)
+        else:
+            resp, content = client.request(url, http_method, req_body, req_headers)
+        if started:
+            if stream:
+                size = None
+            else:
+                size = len(content)
+            _emit('fetch', { 'url': url, 'status': resp.status, 'seconds': time.time() - started, 
+                             'bytes': size, 'fromcache': resp.fromcache, 'stream': stream })
     except IOError:
         # An IOError can happen, for example, when httplib2 can't write 
         # to its cache.
         # For now, just re-raise the exception.
         raise
+    try:
+        _checkResponse(resp)
+    except:
+        if hasattr(content, 'close'):
+            content.close()
+        raise
+    return resp, content
+
+def _checkResponse(resp):
+    """Raises the error matching an HTTP response's status or content 
+    type, if it has one."""
+    valid_content_types = [ 'application/xml', 'text/xml' ]
     # Deal with various HTTP error states
     if resp.status == 403:
         raise URLForbiddenError
@@ -548,10 +1618,14 @@ def _fetch(url, http_method="GET", form_data=None, cache_dir=DEFAULT_HTTP_CACHE_
         raise URLNotFoundError
     if resp.status == 410:
         raise URLGoneError
+    if resp.status == 429:
+        raise TooManyRequestsError
     if resp.status == 500:
         raise InternalServerError
     if resp.status == 503:
         raise ServiceUnavailableError
+    if resp.status == 304:
+        return
     # Bail if proper XML content-type not given
     content_type, charset = _parse_content_type(resp['content-type'])
     if content_type in valid_content_types:
@@ -559,40 +1633,148 @@ def _fetch(url, http_method="GET", form_data=None, cache_dir=DEFAULT_HTTP_CACHE_
         pass
     else:
         raise UnsupportedContentTypeError
-    return resp, content
 
-def _getResponse(url_or_file, http_method="GET", form_data=None, cache_dir=DEFAULT_HTTP_CACHE_DIR, proxy_info=None):
+def _getResponse(url_or_file, http_method="GET", form_data=None, cache_dir=DEFAULT_HTTP_CACHE_DIR, proxy_info=None, client=None, headers=None, stream=False):
     """Fetches the Tumblr API XML and returns both the HTTP status and 
     the content body.
     
-    Instead of a URL, this method also accepts an open file or a Tumblr
-    XML string.  In those cases, the HTTP status is returned as None."""
+    Instead of a URL, this method also accepts a file path, an open file 
+    or other file-like object (including a memory map), or a Tumblr XML 
+    string.  In those cases, the HTTP status is returned as None.  Files 
+    aren't read here: the content returned is the open file itself, to be 
+    read a chunk at a time by the parser.  A file opened from a path is 
+    the caller's to close, as is a URL's content if stream is True."""
     resp = None
-    if isinstance(url_or_file, file):
-        # Open file
-        content = url_or_file.read()
+    if hasattr(url_or_file, 'read'):
+        # Open file, memory map or other file-like object
+        content = url_or_file
+    elif _isPath(url_or_file):
+        # File path
+        content = open(url_or_file, 'rb')
     elif _isUrl(url_or_file):
         # URL
-        resp, content = _fetch(url_or_file, http_method, form_data, cache_dir, proxy_info)
+        resp, content = _fetch(url_or_file, http_method, form_data, cache_dir, proxy_info, client, headers, stream)
     else:
         # String
         content = url_or_file
     return resp, content
 
+def _chunks(source):
+    """Yields the contents of a file-like object a chunk at a time.
+    
+    Memory maps are handed out as buffers onto the map, so nothing is 
+    copied."""
+    if isinstance(source, mmap.mmap):
+        for offset in xrange(source.tell(), len(source), CHUNK_SIZE):
+            yield buffer(source, offset, CHUNK_SIZE)
+        return
+    while True:
+        chunk = source.read(CHUNK_SIZE)
+        if not chunk:
+            return
+        yield chunk
+
+def _digest(content):
+    """Returns a hash of a string or of the rest of a seekable file, which 
+    is left where it was."""
+    sha1 = hashlib.sha1()
+    if hasattr(content, 'read'):
+        position = content.tell()
+        for chunk in _chunks(content):
+            sha1.update(chunk)
+        content.seek(position)
+    else:
+        sha1.update(content)
+    return sha1.hexdigest()
+
 def _getTree(content):
-    """Returns an ElementTree representation of the content."""
+    """Returns an ElementTree representation of the content.
+    
+    The content may be a string, or a file-like object, which is fed to 
+    the parser a chunk at a time instead of being read in all at once."""
     try:
-        tree = ElementTree.fromstring(content)
+        if hasattr(content, 'read'):
+            parser = ElementTree.XMLParser()
+            for chunk in _chunks(content):
+                parser.feed(chunk)
+            tree = parser.close()
+        else:
+            tree = ElementTree.fromstring(content)
     except SyntaxError:
         raise TumblrParseError, "SyntaxError while parsing XML!"
     return tree
     
-def authenticate(email, password, include_theme=False, cache_dir=DEFAULT_HTTP_CACHE_DIR, proxy_info=None):
-    """Authenticates to the Tumblr API service."""
+def _buildPost(postdata, feeds, keep_postdata=True, lazy=False):
+    """Instantiates the appropriate Post object for a post element and 
+    attaches its source feed, if present."""
+    # What kind of post of this?
+    # Find out and instantiate an appropriate object
+    post = POST_TYPES.get(postdata.attrib.get('type'), Post)(postdata, lazy)
+    # Get the source feed, if present
+    try:
+        if post.source_feed_id:
+            post.source_feed = feeds[post.source_feed_id]
+    except (KeyError, TypeError):
+        # It's possible that the Tumblr API XML response will include 
+        # a bogus feed ID. I don't know why.
+        # A TypeError means that the tumblelog has no feeds at all.
+        # TODO: Add a test case for this.
+        pass
+    if not (keep_postdata or lazy):
+        post.postdata = None
+    return post
+
+def _threaded(func, items, workers, pool):
+    """Calls func on each of the given items on a _WorkerPool, with up to 
+    workers calls running at once.
+    
+    Yields (index, result, exception) tuples in the order in which the 
+    calls finish.  Exactly one of result and exception is meaningful.  
+    Items are only handed to the pool as earlier calls finish, so once 
+    the generator is closed no more calls are started."""
+    results = _get_queue().Queue()
+    def call(i, item):
+        try:
+            return i, func(item), None
+        except Exception, e:
+            return i, None, e
+    def finished(result):
+        results.put(result.get())
+    queued = list(enumerate(items))
+    queued.reverse()
+    running = 0
+    while queued or running:
+        while queued and running < max(1, workers):
+            pool.submit(call, queued.pop(), finished)
+            running += 1
+        running -= 1
+        yield results.get()
+
+def _mergePosts(pages):
+    """Concatenates the posts of several Tumblelog pages, in order, 
+    dropping posts that have already been seen.
+    
+    Posts can show up on two pages if the tumblelog is updated while it 
+    is being read."""
+    seen = set()
+    posts = []
+    for page in pages:
+        for post in page.posts:
+            if post.id not in seen:
+                seen.add(post.id)
+                posts.append(post)
+    return posts
+
+def authenticate(email, password, include_theme=False, cache_dir=DEFAULT_HTTP_CACHE_DIR, proxy_info=None, client=None, base_url=BASE_AUTH_URL):
+    """Authenticates to the Tumblr API service.
+    
+    Pass a Client to reuse its connections; cache_dir and proxy_info are 
+    then ignored in favor of the client's own settings.  base_url can 
+    point elsewhere for testing."""
     # Interestingly, the Tumblr API service expects POST params to be in the 
     # URL, not the request body.
-    auth_url = AuthUrl().set_email(email).set_password(password).set_include_theme(include_theme).url
-    resp, content = _getResponse(auth_url, "POST", None, cache_dir, proxy_info)
+    auth_url = AuthUrl(base_url).set_email(email).set_password(password).set_include_theme(include_theme).url
+    resp, content = _getResponse(auth_url, "POST", None, cache_dir, proxy_info, client)
     tree = _getTree(content)
     version = tree.attrib.get('version')
     user = UserAuthInfo(tree.find('user'))
@@ -602,49 +1784,1243 @@ def authenticate(email, password, include_theme=False, cache_dir=DEFAULT_HTTP_CA
     authinfo = AuthInfo(version, user, tumblelogs)
     return resp, authinfo
     
-def parse(url_or_file, cache_dir=DEFAULT_HTTP_CACHE_DIR, proxy_info=None):
+def _parseCacheKey(url_or_file, resp, content, *options):
+    """Returns the parse cache key for a response.
+    
+    Responses to URLs are identified by the URL and their ETag or 
+    Last-Modified validator; anything else by a hash of its content.  
+    The key is a hash itself, so that caches of files can use it."""
+    validator = _validator(resp)
+    if validator is None:
+        key = (_digest(content),) + options
+    else:
+        key = (url_or_file, validator) + options
+    return hashlib.sha1(repr(key)).hexdigest()
+
+def _validator(resp):
+    """Returns a response's ETag, or else its Last-Modified, or None."""
+    if resp is None:
+        return None
+    return resp.get('etag') or resp.get('last-modified')
+
+def _conditionalHeaders(etag, last_modified):
+    """Returns the request headers that make a GET conditional on the 
+    given validators."""
+    headers = {}
+    if etag is not None:
+        headers['If-None-Match'] = etag
+    if last_modified is not None:
+        headers['If-Modified-Since'] = last_modified
+    return headers
+
+def _isNotModified(resp, etag, last_modified):
+    """Tells whether a response is unchanged from the given validators.
+    
+    Besides a plain 304, this catches the case where httplib2 answered 
+    from its own cache: it turns the server's 304 into a 200 with the 
+    cached content, whose validators are still the ones we sent."""
+    if resp is None:
+        return False
+    if resp.status == 304:
+        return True
+    if etag is not None:
+        return resp.get('etag') == etag
+    if last_modified is not None:
+        return resp.get('last-modified') == last_modified
+    return False
+
+def _setResponse(tumblelog, resp):
+    """Sets a Tumblelog's http_response and validators."""
+    tumblelog.http_response = resp
+    if resp is None:
+        tumblelog.etag = tumblelog.last_modified = None
+    else:
+        tumblelog.etag = resp.get('etag')
+        tumblelog.last_modified = resp.get('last-modified')
+
+def parse(url_or_file, cache_dir=DEFAULT_HTTP_CACHE_DIR, proxy_info=None, client=None, keep_postdata=True, lazy=False, parse_cache=None, types=None, etag=None, last_modified=None, stream=False):
     """Parses Tumblr API XML into Python data structures.
     
-    Accepts either a URL, an open file, or a hunk of XML in a string.
+    Accepts either a URL, a file path, an open file (or other file-like 
+    object, such as a memory map), or a hunk of XML in a string.  Files 
+    are parsed a chunk at a time, so they are never held in memory whole.
+    Pass a Client to reuse its connections across calls.  If keep_postdata 
+    is False, posts don't hold on to their XML elements, which lets the 
+    whole tree be freed once parsing is done.
+    
+    If lazy is True, only the attributes common to all posts (id, url, 
+    unixtime and so on) are parsed up front; the rest are pulled from the 
+    XML when first read.  Lazy posts always keep their postdata.
+    
+    If types is given, only posts of those types (such as 'photo' or 
+    'link') are parsed; no objects are made for the others.
+    
+    If a parse_cache (such as a MemoryCache) is given, or the Client has 
+    one, a response that hasn't changed since it was last parsed isn't 
+    parsed again.  A MemoryCache gives back a copy of the Tumblelog from 
+    before, with this response's http_response and validators but the 
+    same posts and feeds, so callers sharing a cache shouldn't modify 
+    those.  Other caches, such as a DiskCache, keep Tumblelogs in the 
+    format of dumps().
+    
+    To poll a URL cheaply, hand back the etag and last_modified of the 
+    Tumblelog from the previous call.  They are sent as If-None-Match and 
+    If-Modified-Since, and if the server answers 304 Not Modified, a 
+    NotModified is returned instead of a Tumblelog, with nothing parsed.
+    
+    >>> log = tumblr.parse(url)
+    >>> log = tumblr.parse(url, etag=log.etag, last_modified=log.last_modified)
+    >>> if log.not_modified: ...
+    
+    If stream is True, a URL's response is fed to the parser as it comes 
+    in rather than being read whole first, and the Client's timeout and 
+    max_bytes are checked as it goes.
     """
-    resp, content = _getResponse(url_or_file, "GET", None, cache_dir, proxy_info)
-    tree = _getTree(content)
+    started = _listeners and time.time()
+    headers = _conditionalHeaders(etag, last_modified)
+    resp, content = _getResponse(url_or_file, "GET", None, cache_dir, proxy_info, client, headers, stream)
+    # Kept to be closed, should content be read into a string below
+    source = content
+    try:
+        if _isNotModified(resp, etag, last_modified):
+            if started:
+                _emitParse(url_or_file, resp, started, True)
+            return NotModified(resp, resp.get('etag', etag), resp.get('last-modified', last_modified))
+        if parse_cache is None and client is not None:
+            parse_cache = client.parse_cache
+        if parse_cache is not None:
+            if hasattr(content, 'read') and not hasattr(content, 'seek') and _validator(resp) is None:
+                # It has to be read twice: once to hash it, once to parse it.  
+                # A response with a validator is keyed without its body.
+                content = content.read()
+            if types is not None:
+                types = frozenset(types)
+                key = _parseCacheKey(url_or_file, resp, content, keep_postdata, lazy, tuple(sorted(types)))
+            else:
+                key = _parseCacheKey(url_or_file, resp, content, keep_postdata, lazy, None)
+            tumblelog = parse_cache.get(key)
+            if started:
+                _emit('cache', { 'key': key, 'hit': tumblelog is not None })
+            if tumblelog is not None:
+                if isinstance(tumblelog, str):
+                    tumblelog = loads(tumblelog)
+                else:
+                    # The cached Tumblelog is shared, but its response isn't
+                    tumblelog = copy.copy(tumblelog)
+                _setResponse(tumblelog, resp)
+                if started:
+                    _emitParse(url_or_file, resp, started, True)
+                return tumblelog
+        tree_started = started and time.time()
+        tree = _getTree(content)
+        if tree_started:
+            _emit('tree', { 'seconds': time.time() - tree_started })
+    finally:
+        if source is not url_or_file and hasattr(source, 'close'):
+            # A file opened from a path, or a streamed response
+            source.close()
     tumblelog = Tumblelog(tree.find('tumblelog'))
-    tumblelog.http_response = resp
+    _setResponse(tumblelog, resp)
     tumblelog.start = int(tree.find('posts').attrib.get('start'))
     tumblelog.num_posts = int(tree.find('posts').attrib.get('total'))
     # Get posts
+    posts_started = started and time.time()
     posts = []
     for postdata in tree.find('posts'):
-        # What kind of post of this?
-        # Find out and instantiate an appropriate object
-        type = postdata.attrib.get('type')
-        if type =='regular':
-            post = Regular(postdata)
-        elif type == 'link':
-            post = Link(postdata)
-        elif type == 'quote':
-            post = Quote(postdata)
-        elif type == 'photo':
-            post = Photo(postdata)
-        elif type == 'conversation':
-            post = Conversation(postdata)
-        elif type == 'video':
-            post = Video(postdata)
-        elif type == 'audio':
-            post = Audio(postdata)
-        else:
-            post = Post(postdata)
-        # Get the source feed, if present
-        try:
-            if post.source_feed_id:
-                post.source_feed = tumblelog.feeds[post.source_feed_id]
-        except KeyError:
-            # It's possible that the Tumblr API XML response will include 
-            # a bogus feed ID. I don't know why.
-            # TODO: Add a test case for this.
-            pass
-        posts.append(post)
+        if types is not None and postdata.attrib.get('type') not in types:
+            continue
+        posts.append(_buildPost(postdata, tumblelog.feeds, keep_postdata, lazy))
     tumblelog.posts = posts
+    if isinstance(parse_cache, MemoryCache):
+        parse_cache.set(key, tumblelog)
+    elif parse_cache is not None:
+        parse_cache.set(key, dumps(tumblelog))
+    if started:
+        _emit('posts', { 'counts': _typeCounts(posts), 'seconds': time.time() - posts_started })
+        _emitParse(url_or_file, resp, started, False)
     return tumblelog
+
+def _emitParse(url_or_file, resp, started, hit):
+    """Emits the parse event for a parse() call begun at started."""
+    if resp is None:
+        url = None
+    else:
+        url = url_or_file
+    _emit('parse', { 'url': url, 'seconds': time.time() - started, 'hit': hit })
+
+def _typeCounts(posts):
+    """Returns a dict of the number of posts of each type."""
+    counts = {}
+    for post in posts:
+        counts[post.type] = counts.get(post.type, 0) + 1
+    return counts
+
+def iterparse(url_or_file, cache_dir=DEFAULT_HTTP_CACHE_DIR, proxy_info=None, client=None, types=None, max_posts=None, stream=False):
+    """Incrementally parses Tumblr API XML, yielding objects as they are read.
+    
+    The first object yielded is the Tumblelog, with start and num_posts set 
+    but with an empty posts list.  Each Post follows as soon as its element 
+    has been read.  Elements are cleared once they have been used, so memory 
+    stays flat however large the document is; because of this, a post's 
+    postdata is always None.
+    
+    Accepts the same kinds of input as parse().  If types is given, only 
+    posts of those types are yielded, and if max_posts is given, no more 
+    than that many are.
+    
+    If stream is True, a URL's response is parsed as it comes in, as 
+    with parse().  Once max_posts posts have been yielded, or as soon as 
+    the caller stops iterating and closes the iterator, the connection 
+    is closed and the rest of the response is never downloaded.
+    """
+    resp, content = _getResponse(url_or_file, "GET", None, cache_dir, proxy_info, client, None, stream)
+    if hasattr(content, 'read'):
+        # Files are read by the parser as it goes
+        source = content
+    else:
+        source = StringIO(content)
+    try:
+        tumblelog = None
+        posts = None
+        count = 0
+        counts = None
+        if _listeners:
+            counts = {}
+            started = time.time()
+        try:
+            for event, elem in ElementTree.iterparse(source, events=('start', 'end')):
+                if event == 'start':
+                    # The posts element's attributes are complete at its start 
+                    # tag, and the tumblelog element always precedes it.
+                    if elem.tag == 'posts':
+                        if tumblelog is None:
+                            raise TumblrOhShitError, "Uh-oh"
+                        tumblelog.start = int(elem.attrib.get('start'))
+                        tumblelog.num_posts = int(elem.attrib.get('total'))
+                        posts = elem
+                        yield tumblelog
+                elif elem.tag == 'tumblelog':
+                    tumblelog = Tumblelog(elem)
+                    _setResponse(tumblelog, resp)
+                    elem.clear()
+                elif elem.tag == 'post' and posts is not None:
+                    if types is None or elem.attrib.get('type') in types:
+                        post = _buildPost(elem, tumblelog.feeds, False)
+                    else:
+                        post = None
+                    # Drop the finished element so that the tree never grows
+                    elem.clear()
+                    posts.remove(elem)
+                    if post is not None:
+                        count += 1
+                        if counts is not None:
+                            counts[post.type] = counts.get(post.type, 0) + 1
+                        yield post
+                        if max_posts is not None and count >= max_posts:
+                            return
+        except SyntaxError:
+            raise TumblrParseError, "SyntaxError while parsing XML!"
+    finally:
+        if content is not url_or_file and hasattr(content, 'close'):
+            # A file opened from a path, or a streamed response
+            content.close()
+        if counts is not None:
+            _emit('posts', { 'counts': counts, 'seconds': time.time() - started })
+
+def fetch_all(name, num=MAX_POSTS_PER_PAGE, workers=4, cache_dir=DEFAULT_HTTP_CACHE_DIR, proxy_info=None, client=None, store=None, **kwargs):
+    """Fetches every post of a tumblelog, downloading pages in parallel.
+    
+    Accepts a tumblelog name or the URL of its read API.  The first page 
+    is read to learn how many posts there are, and the remaining pages are 
+    then fetched by up to workers threads at once.  The threads are those 
+    of the Client, so they are capped by its own workers, and reuse its 
+    kept-alive connections from one call to the next.
+    
+    Returns the first page's Tumblelog, with posts holding every post in 
+    order and without duplicates.  If a PostStore is given, the posts are 
+    added to it as well.  Any other keyword arguments, such as types, are 
+    passed on to parse().
+    """
+    if client is None:
+        client = Client(cache_dir, proxy_info, workers=workers)
+    # The API never returns more than this, and pages must not be 
+    # stepped over any faster than it does return them
+    num = min(num, MAX_POSTS_PER_PAGE)
+    def fetch_page(start):
+        return parse(ReadUrl(name).set_start(start).set_num(num).url, client=client, **kwargs)
+    tumblelog = fetch_page(0)
+    starts = range(num, tumblelog.num_posts, num)
+    pages = [ None ] * len(starts)
+    for i, page, error in _threaded(fetch_page, starts, workers, client._pool):
+        if error is not None:
+            raise error
+        pages[i] = page
+    tumblelog.posts = _mergePosts([ tumblelog ] + pages)
+    if store is not None:
+        store.add(tumblelog)
+    return tumblelog
+
+def parse_many(urls, concurrency=8, progress=None, cache_dir=DEFAULT_HTTP_CACHE_DIR, proxy_info=None, client=None, **kwargs):
+    """Parses many tumblelogs at once, with up to concurrency of them 
+    being fetched and parsed at the same time.
+    
+    Yields a (url, result) tuple as each one finishes, in whatever order 
+    they finish in.  The result is either the Tumblelog or the exception 
+    that parsing it raised, such as URLNotFoundError or TumblrParseError; 
+    one failure doesn't stop the others.  If given, progress is called as 
+    progress(done, total, url, result) after each one.  Any other keyword 
+    arguments are passed on to parse().
+    
+    The work runs on the threads of the Client, so concurrency is capped 
+    by its own workers, and its kept-alive connections are reused from 
+    one call to the next.  URLs that haven't been started yet are 
+    dropped if the caller stops iterating early.
+    
+    >>> for url, result in tumblr.parse_many(urls, concurrency=16):
+    ...     if isinstance(result, tumblr.TumblrError):
+    ...         print url, "failed"
+    """
+    if client is None:
+        client = Client(cache_dir, proxy_info, workers=concurrency)
+    urls = list(urls)
+    done = 0
+    for i, tumblelog, error in _threaded(lambda url: parse(url, client=client, **kwargs), urls, concurrency, client._pool):
+        done += 1
+        if error is not None:
+            result = error
+        else:
+            result = tumblelog
+        if progress is not None:
+            progress(done, len(urls), urls[i], result)
+        yield urls[i], result
+
+def _parseFile(path, **kwargs):
+    """Parses a file in a worker process.  Returns the Tumblelog, or the 
+    exception raised while parsing it."""
+    try:
+        return parse(path, keep_postdata=False, **kwargs)
+    except Exception, e:
+        return e
+
+def parse_files(paths, processes=None, chunksize=8, **kwargs):
+    """Parses many files of Tumblr API XML, spreading the work over a pool 
+    of processes (one per CPU, unless told otherwise).
+    
+    Yields a (path, result) tuple for each file, in the order given.  The 
+    result is either the Tumblelog or the exception that parsing it 
+    raised.  Posts come back without their postdata, which keeps them 
+    cheap to send between processes.  Any other keyword arguments are 
+    passed on to parse().
+    """
+    import multiprocessing
+    from functools import partial
+    paths = list(paths)
+    pool = multiprocessing.Pool(processes)
+    finished = False
+    try:
+        results = pool.imap(partial(_parseFile, **kwargs), paths, chunksize)
+        for i, result in enumerate(results):
+            yield paths[i], result
+        finished = True
+    finally:
+        # Don't leave workers parsing files that nobody wants any more
+        if finished:
+            pool.close()
+        else:
+            pool.terminate()
+        pool.join()
+
+def sync(name, since_id=None, num=MAX_POSTS_PER_PAGE, cache_dir=DEFAULT_HTTP_CACHE_DIR, proxy_info=None, client=None, types=None, store=None, stream=False):
+    """Fetches the posts of a tumblelog that are newer than since_id.
+    
+    The read API lists posts newest first, so pages are read one at a 
+    time only until a post with an id of since_id or lower turns up, and 
+    parsing stops right there.  With no since_id, every post is fetched.
+    
+    Returns a (posts, high_water_mark) tuple.  posts holds the new posts, 
+    newest first, and high_water_mark is the id to pass as since_id next 
+    time.  If types is given, only posts of those types are returned.  If 
+    a PostStore is given, the new posts and the high water mark are added 
+    to it as well, so that store.high_water_mark() can stand in for 
+    since_id next time.
+    
+    Pages go through the Client's HTTP cache and kept-alive connections.  
+    If stream is True, they are streamed on connections of their own 
+    instead, so the rest of the last page isn't even downloaded.
+    """
+    if client is None:
+        client = Client(cache_dir, proxy_info)
+    # A page holding fewer posts than asked for must mean the last page
+    num = min(num, MAX_POSTS_PER_PAGE)
+    posts = []
+    seen = set()
+    high_water_mark = since_id
+    start = 0
+    done = False
+    tumblelog = None
+    while not done:
+        items = iterparse(ReadUrl(name).set_start(start).set_num(num).url, client=client, stream=stream)
+        try:
+            try:
+                tumblelog = items.next()
+            except StopIteration:
+                break
+            count = 0
+            for post in items:
+                if since_id is not None and post.id <= since_id:
+                    done = True
+                    break
+                count += 1
+                if high_water_mark is None or post.id > high_water_mark:
+                    high_water_mark = post.id
+                # Every post is needed to find the boundary, so other types 
+                # can only be filtered out here
+                if post.id not in seen and (types is None or post.type in types):
+                    seen.add(post.id)
+                    posts.append(post)
+        finally:
+            # Stop downloading a page once the boundary has been found
+            items.close()
+        start += num
+        if count < num or start >= tumblelog.num_posts:
+            done = True
+    if store is not None and tumblelog is not None:
+        # Posts of other types count towards the mark too
+        store.add(tumblelog.name, posts, high_water_mark)
+    return posts, high_water_mark
+
+#######################################################################
+#
+# Export
+#
+#######################################################################
+
+# Columns exported by to_columns() unless told otherwise
+COLUMNS = ('id', 'unixtime', 'type', 'url', 'date_gmt', 'title', 'body', 'link_url', 'source')
+# Columns held as integers, and as categories; the rest hold strings
+INT_COLUMNS = ('id', 'unixtime', 'source_feed_id')
+CATEGORICAL_COLUMNS = ('type',)
+# Post ids don't fit in 32 bits, so where a C long is that small they 
+# are stored as doubles, which hold integers exactly up to 2**53.
+if array('l').itemsize >= 8:
+    _INT_TYPECODE = 'l'
+else:
+    _INT_TYPECODE = 'd'
+
+
+class Columns(object):
+    """Posts laid out column by column, for analytics.
+    
+    Integer columns are array module arrays, and string columns are lists 
+    of unicode strings, with None where a post has no such field.  A 
+    categorical column, such as type, is an array of codes indexing into 
+    its list of categories:
+    
+    >>> columns = tumblr.to_columns(log)
+    >>> columns.categories['type'][columns['type'][0]]
+    'regular'
     
+    With NumPy or pyarrow installed, to_numpy(), to_arrow() and 
+    write_parquet() turn the columns into those libraries' types.
+    
+    Attributes:
+    - names
+    - categories
+    """
+    def __init__(self, names):
+        super(Columns, self).__init__()
+        self.names = tuple(names)
+        self.categories = {}
+        self._codes = {}
+        self._data = {}
+        for name in self.names:
+            if name in INT_COLUMNS:
+                self._data[name] = array(_INT_TYPECODE)
+            elif name in CATEGORICAL_COLUMNS:
+                self._data[name] = array('H')
+                self.categories[name] = []
+                self._codes[name] = {}
+            else:
+                self._data[name] = []
+
+    def __len__(self):
+        if not self.names:
+            return 0
+        return len(self._data[self.names[0]])
+
+    def __getitem__(self, name):
+        return self._data[name]
+
+    def append(self, post):
+        """Adds a post's fields to the end of each column."""
+        for name in self.names:
+            value = getattr(post, name, None)
+            if name in INT_COLUMNS:
+                if value is None:
+                    value = -1
+                self._data[name].append(value)
+            elif name in CATEGORICAL_COLUMNS:
+                codes = self._codes[name]
+                code = codes.get(value)
+                if code is None:
+                    code = codes[value] = len(codes)
+                    self.categories[name].append(value)
+                self._data[name].append(code)
+            else:
+                self._data[name].append(value)
+
+    def to_numpy(self):
+        """Returns a dict of NumPy arrays, one per column.  Categorical 
+        columns hold codes, as here; string columns are object arrays."""
+        import numpy
+        arrays = {}
+        for name in self.names:
+            column = self._data[name]
+            if isinstance(column, array):
+                # Copied in one go rather than element by element
+                if len(column):
+                    arrays[name] = numpy.frombuffer(column.tostring(), dtype=column.typecode)
+                else:
+                    arrays[name] = numpy.zeros(0, dtype=column.typecode)
+            else:
+                arrays[name] = numpy.array(column, dtype=object)
+        return arrays
+
+    def to_arrow(self):
+        """Returns a pyarrow Table, with categorical columns as 
+        dictionary arrays."""
+        import pyarrow
+        arrays = []
+        for name in self.names:
+            column = self._data[name]
+            if name in CATEGORICAL_COLUMNS:
+                arrays.append(pyarrow.DictionaryArray.from_arrays(
+                    pyarrow.array(column.tolist(), type=pyarrow.int16()),
+                    pyarrow.array(self.categories[name], type=pyarrow.string())))
+            elif name in INT_COLUMNS:
+                arrays.append(pyarrow.array(column.tolist(), type=pyarrow.int64()))
+            else:
+                arrays.append(pyarrow.array(column, type=pyarrow.string()))
+        return pyarrow.Table.from_arrays(arrays, list(self.names))
+
+    def write_parquet(self, path):
+        """Writes the columns to a Parquet file."""
+        import pyarrow.parquet
+        pyarrow.parquet.write_table(self.to_arrow(), path)
+
+
+def _iterPosts(items):
+    """Yields the posts in a Tumblelog, a Post, or an iterable of 
+    Tumblelogs and posts, skipping NotModified results."""
+    if hasattr(items, 'posts') or isinstance(items, Post):
+        items = [ items ]
+    for item in items:
+        if getattr(item, 'not_modified', False):
+            continue
+        if hasattr(item, 'posts'):
+            for post in item.posts:
+                yield post
+        else:
+            yield item
+
+def to_columns(items, names=COLUMNS):
+    """Exports posts as Columns.
+    
+    Accepts a Tumblelog or any iterable of Tumblelogs and posts, such as 
+    a list of pages or the output of iterparse(), which is consumed as it 
+    goes so that the posts themselves never all have to be kept.  
+    NotModified results are skipped.  Each post adds a row; names are the 
+    post attributes to export as columns.
+    
+    >>> columns = tumblr.to_columns(tumblr.iterparse(url, stream=True))
+    """
+    columns = Columns(names)
+    for post in _iterPosts(items):
+        columns.append(post)
+    return columns
+
+#######################################################################
+#
+# Storage
+#
+#######################################################################
+
+_STORE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS posts (
+    tumblelog TEXT NOT NULL,
+    id INTEGER NOT NULL,
+    unixtime INTEGER NOT NULL,
+    type TEXT NOT NULL,
+    source_feed_id INTEGER,
+    post BLOB NOT NULL,
+    PRIMARY KEY (tumblelog, id)
+);
+CREATE INDEX IF NOT EXISTS posts_id ON posts (id);
+CREATE INDEX IF NOT EXISTS posts_unixtime ON posts (tumblelog, unixtime);
+CREATE INDEX IF NOT EXISTS posts_type ON posts (tumblelog, type, unixtime);
+CREATE INDEX IF NOT EXISTS posts_source_feed_id ON posts (source_feed_id, unixtime);
+CREATE TABLE IF NOT EXISTS marks (
+    tumblelog TEXT PRIMARY KEY,
+    id INTEGER NOT NULL
+);
+"""
+
+
+class PostStore(object):
+    """Keeps posts in an SQLite database, for querying them offline.
+    
+    Posts are filed under the name of their tumblelog, and indexed by id, 
+    unixtime, type and source feed id.  They are kept in the format of 
+    dumps(), and queries give back the same Post subclasses that were 
+    stored, without their postdata.  The default 
+    path of ':memory:' keeps the store in memory only.
+    
+    >>> store = tumblr.PostStore('posts.db')
+    >>> tumblr.sync('demo', store=store)
+    >>> photos = store.query('demo', types=['photo'], since=march, until=april)
+    
+    Attributes:
+    - path
+    """
+    def __init__(self, path=':memory:'):
+        super(PostStore, self).__init__()
+        import sqlite3
+        self.path = path
+        self._sqlite3 = sqlite3
+        self._db = sqlite3.connect(path)
+        self._db.executescript(_STORE_SCHEMA)
+
+    def __len__(self):
+        return self.count()
+
+    def add(self, tumblelog, posts=None, high_water_mark=None):
+        """Stores posts, replacing any already stored with the same ids.
+        
+        tumblelog is either a Tumblelog, whose posts are stored unless 
+        others are given, or the name to file the posts under.  If 
+        high_water_mark is given, high_water_mark() returns at least that 
+        from then on, even if no post with that id is stored, as when 
+        sync() only keeps some types of post."""
+        if isinstance(tumblelog, Tumblelog):
+            if posts is None:
+                posts = tumblelog.posts
+            tumblelog = tumblelog.name
+        rows = []
+        for post in posts:
+            rows.append((tumblelog, post.id, post.unixtime, post.type, 
+                         post.source_feed_id, self._sqlite3.Binary(dumps(post))))
+        self._db.executemany("INSERT OR REPLACE INTO posts VALUES (?, ?, ?, ?, ?, ?)", rows)
+        if high_water_mark is not None:
+            self._db.execute("INSERT OR IGNORE INTO marks VALUES (?, ?)", (tumblelog, high_water_mark))
+            self._db.execute("UPDATE marks SET id = MAX(id, ?) WHERE tumblelog = ?", 
+                             (high_water_mark, tumblelog))
+        self._db.commit()
+
+    def get(self, tumblelog, id):
+        """Returns a stored post, or None."""
+        row = self._db.execute("SELECT post FROM posts WHERE tumblelog = ? AND id = ?", 
+                               (tumblelog, id)).fetchone()
+        if row is None:
+            return None
+        return loads(str(row[0]))
+
+    def _where(self, tumblelog, types, since, until, source_feed_id):
+        """Returns the WHERE clause and parameters for a query."""
+        clauses = []
+        params = []
+        if tumblelog is not None:
+            clauses.append("tumblelog = ?")
+            params.append(tumblelog)
+        if types is not None:
+            if isinstance(types, basestring):
+                types = [ types ]
+            types = list(types)
+            clauses.append("type IN (%s)" % ", ".join([ "?" ] * len(types)))
+            params.extend(types)
+        if since is not None:
+            clauses.append("unixtime >= ?")
+            params.append(since)
+        if until is not None:
+            clauses.append("unixtime < ?")
+            params.append(until)
+        if source_feed_id is not None:
+            clauses.append("source_feed_id = ?")
+            params.append(source_feed_id)
+        if not clauses:
+            return "", params
+        return " WHERE " + " AND ".join(clauses), params
+
+    def query(self, tumblelog=None, types=None, since=None, until=None, source_feed_id=None, limit=None):
+        """Returns stored posts, newest first.
+        
+        Each argument given narrows the search: to a tumblelog, to posts 
+        of one type or of any of a list of types, to posts with a 
+        unixtime from since up to but not including until, or to posts 
+        from one source feed.  At most limit posts are returned."""
+        where, params = self._where(tumblelog, types, since, until, source_feed_id)
+        sql = "SELECT post FROM posts" + where + " ORDER BY unixtime DESC, id DESC"
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
+        return [ loads(str(row[0])) for row in self._db.execute(sql, params) ]
+
+    def count(self, tumblelog=None, types=None, since=None, until=None, source_feed_id=None):
+        """Returns the number of stored posts that query() would return."""
+        where, params = self._where(tumblelog, types, since, until, source_feed_id)
+        return self._db.execute("SELECT COUNT(*) FROM posts" + where, params).fetchone()[0]
+
+    def high_water_mark(self, tumblelog):
+        """Returns the highest post id stored for a tumblelog, or the high 
+        water mark given to add() if that's higher, or None.  This is what 
+        to pass to sync() as since_id."""
+        return self._db.execute("SELECT MAX(id) FROM (SELECT MAX(id) AS id FROM posts WHERE tumblelog = ? "
+                                "UNION ALL SELECT id FROM marks WHERE tumblelog = ?)", 
+                                (tumblelog, tumblelog)).fetchone()[0]
+
+    def close(self):
+        self._db.close()
+
+#######################################################################
+#
+# Search
+#
+#######################################################################
+
+_TAG = re.compile(r'<[^>]*>')
+_ENTITY = re.compile(r'&(#x|#)?(\w+);')
+_WORD = re.compile(r'\w+', re.UNICODE)
+# Query tokens: quoted phrases, parentheses, and anything else up to a space
+_QUERY_TOKEN = re.compile(r'"([^"]*)"|([()])|([^\s()"]+)')
+SEARCH_INDEX_VERSION = 1
+
+def _unescapeEntity(m):
+    kind, name = m.group(1), m.group(2)
+    try:
+        if kind == '#':
+            return unichr(int(name))
+        if kind == '#x':
+            return unichr(int(name, 16))
+        return unichr(htmlentitydefs.name2codepoint[name])
+    except (KeyError, ValueError, OverflowError):
+        return m.group(0)
+
+def _stripHtml(text):
+    """Returns text with its HTML tags taken out and entities decoded."""
+    return _ENTITY.sub(_unescapeEntity, _TAG.sub(' ', text))
+
+def _tokenize(text):
+    """Returns the lowercased words of a piece of text."""
+    return _WORD.findall(_unicode(text).lower())
+
+def _searchText(post):
+    """Returns the searchable pieces of text of a post."""
+    lines = getattr(post, 'lines', None)
+    if lines:
+        # A conversation's content is its lines run together
+        names = ('title',)
+    else:
+        names = ('title', 'content', 'source')
+    texts = []
+    for name in names:
+        text = getattr(post, name, None)
+        if text:
+            texts.append(text)
+    for line in lines or ():
+        texts.append(line.content)
+    return texts
+
+
+class SearchIndex(object):
+    """An inverted index for full-text search over posts.
+    
+    The titles and bodies of posts (the quote and source of a quote, the 
+    caption of a photo, the lines of a conversation and so on) are 
+    stripped of HTML and split into lowercased words, and the position 
+    of each word is kept, so that phrases can be searched for.  Adding a 
+    post that is already indexed replaces it.
+    
+    Queries are made of words, which must all be present, and of 
+    "quoted phrases", combined with OR and NOT (or a leading -) and 
+    grouped with parentheses:
+    
+    >>> index = tumblr.SearchIndex()
+    >>> index.add(tumblr.parse(url))
+    >>> index.search('"golden hours" (photo OR video) -draft')
+    [26510631, 26462133]
+    
+    save() and load() keep the index on disk, compressed, in the format 
+    of dumps().
+    """
+    def __init__(self):
+        super(SearchIndex, self).__init__()
+        # Maps each word to a dict of post id to the word's positions
+        self._postings = {}
+        # Maps each post id to the words it contains, for replacing it
+        self._words = {}
+
+    def __len__(self):
+        return len(self._words)
+
+    def __contains__(self, id):
+        return id in self._words
+
+    def add(self, items):
+        """Indexes a Post, the posts of a Tumblelog, or an iterable of 
+        Tumblelogs and posts such as the output of iterparse()."""
+        for post in _iterPosts(items):
+            self.remove(post.id)
+            positions = {}
+            position = 0
+            for text in _searchText(post):
+                for word in _tokenize(_stripHtml(text)):
+                    positions.setdefault(word, []).append(position)
+                    position += 1
+                # Keep phrases from matching across two fields
+                position += 1
+            for word, word_positions in positions.iteritems():
+                self._postings.setdefault(word, {})[post.id] = tuple(word_positions)
+            self._words[post.id] = tuple(positions)
+
+    def remove(self, id):
+        """Takes a post out of the index, if it's there."""
+        words = self._words.pop(id, None)
+        if words is None:
+            return
+        for word in words:
+            postings = self._postings[word]
+            del postings[id]
+            if not postings:
+                del self._postings[word]
+
+    def _phrase(self, words):
+        """Returns the ids of the posts containing the words in order."""
+        if not words:
+            return set()
+        postings = [ self._postings.get(word, {}) for word in words ]
+        ids = set(postings[0])
+        for p in postings[1:]:
+            ids.intersection_update(p)
+        if len(words) == 1:
+            return ids
+        found = set()
+        for id in ids:
+            following = [ set(p[id]) for p in postings[1:] ]
+            for start in postings[0][id]:
+                for i, positions in enumerate(following):
+                    if start + i + 1 not in positions:
+                        break
+                else:
+                    found.add(id)
+                    break
+        return found
+
+    def _parseQuery(self, tokens):
+        """Evaluates query tokens as a series of OR'd terms."""
+        ids = self._parseAnd(tokens)
+        while tokens and tokens[0] == ('word', 'OR'):
+            tokens.pop(0)
+            ids = ids | self._parseAnd(tokens)
+        return ids
+
+    def _parseAnd(self, tokens):
+        include = None
+        exclude = set()
+        terms = 0
+        while tokens and tokens[0] not in (('word', 'OR'), ('paren', ')')):
+            negate = False
+            if tokens[0] == ('word', 'NOT'):
+                tokens.pop(0)
+                negate = True
+            elif tokens[0] == ('word', 'AND'):
+                tokens.pop(0)
+                continue
+            elif tokens[0][0] == 'word' and tokens[0][1].startswith('-') and len(tokens[0][1]) > 1:
+                tokens[0] = ('word', tokens[0][1][1:])
+                negate = True
+            ids = self._parseTerm(tokens)
+            terms += 1
+            if negate:
+                exclude |= ids
+            elif include is None:
+                include = ids
+            else:
+                include &= ids
+        if not terms:
+            # As with "you OR", "OR you" or "()"
+            raise TumblrError, "Empty clause in search query"
+        if include is None:
+            # Only exclusions: everything but them
+            include = set(self._words)
+        return include - exclude
+
+    def _parseTerm(self, tokens):
+        if not tokens:
+            raise TumblrError, "Incomplete search query"
+        kind, value = tokens.pop(0)
+        if kind == 'paren':
+            if value != '(':
+                raise TumblrError, "Unbalanced parentheses in search query"
+            ids = self._parseQuery(tokens)
+            if not tokens or tokens.pop(0) != ('paren', ')'):
+                raise TumblrError, "Unbalanced parentheses in search query"
+            return ids
+        # Words that tokenize into several, like "can't", are phrases too
+        return self._phrase(_tokenize(value))
+
+    def search(self, query):
+        """Returns the ids of the posts matching a query, highest first."""
+        tokens = []
+        for phrase, paren, word in _QUERY_TOKEN.findall(_unicode(query)):
+            if paren:
+                tokens.append(('paren', paren))
+            elif word:
+                tokens.append(('word', word))
+            else:
+                tokens.append(('phrase', phrase))
+        if not tokens:
+            return []
+        ids = self._parseQuery(tokens)
+        if tokens:
+            raise TumblrError, "Unbalanced parentheses in search query"
+        return sorted(ids, reverse=True)
+
+    def save(self, path):
+        """Writes the index to a file."""
+        # The words of each post can be rebuilt from the postings, so only 
+        # the ids are saved, for posts without any words
+        data = zlib.compress(dumps((SEARCH_INDEX_VERSION, self._postings, list(self._words))), 6)
+        f = open(path, 'wb')
+        try:
+            f.write(data)
+        finally:
+            f.close()
+
+    def load(cls, path):
+        """Reads an index written by save()."""
+        f = open(path, 'rb')
+        try:
+            data = f.read()
+        finally:
+            f.close()
+        try:
+            data = loads(zlib.decompress(data))
+        except zlib.error:
+            raise TumblrParseError, "Not a saved search index"
+        if not isinstance(data, tuple) or len(data) != 3:
+            raise TumblrParseError, "Not a saved search index"
+        if data[0] != SEARCH_INDEX_VERSION:
+            raise TumblrError, "Unsupported search index version %r" % (data[0],)
+        version, postings, ids = data
+        index = cls()
+        index._postings = postings
+        words = dict([ (id, []) for id in ids ])
+        for word, word_postings in postings.iteritems():
+            for id in word_postings:
+                words.setdefault(id, []).append(word)
+        for id, id_words in words.iteritems():
+            index._words[id] = tuple(id_words)
+        return index
+    load = classmethod(load)
+
+#######################################################################
+#
+# Serialization
+#
+# dumps() writes, in order:
+#
+# - the magic string "TBLR" and a version byte
+# - a table of every distinct string, each once: a kind byte for each 
+#   (0 for str, 1 for unicode), then their lengths, then their UTF-8 
+#   bytes run together
+# - a table of object shapes: a class name and the names of the fields 
+#   that follow each object of that shape, as string table indexes
+# - the value itself, as five streams: a tag byte for each value, then 
+#   the 32-bit counts and indexes, the 32-bit integers, the 64-bit 
+#   integers and the doubles that the tags call for, in the same order
+#
+# Strings and shapes are written as indexes into their tables, and an 
+# object seen before is written as a reference to it, so posts share 
+# their source feeds as they did before.  Keeping each kind of number in 
+# a stream of its own lets each stream be unpacked in one go.  All 
+# numbers are little-endian, and every table and stream starts with its 
+# length as a 32-bit count.
+#
+#######################################################################
+
+SERIAL_MAGIC = 'TBLR'
+SERIAL_VERSION = 1
+
+_U8 = struct.Struct('<B')
+_U32 = struct.Struct('<I')
+
+def _serialClasses():
+    """Returns the classes that dumps() and loads() accept, by name."""
+    classes = [ Tumblelog, NotModified, Feed, Line, Post, 
+                AuthInfo, UserAuthInfo, TumblelogAuthInfo ]
+    for constructor in POST_TYPES.values():
+        if isinstance(constructor, type) and issubclass(constructor, Post):
+            classes.append(constructor)
+    return dict([ (cls.__name__, cls) for cls in classes ])
+
+def _objectState(obj):
+    """Returns the attributes of an object to be serialized."""
+    if isinstance(obj, _Compact):
+        # Posts leave out their postdata here, as when they are pickled
+        return obj.__getstate__()
+    state = dict(obj.__dict__)
+    # The HTTP response belongs to the request that got it
+    state.pop('http_response', None)
+    return state
+
+
+class _Encoder(object):
+    def __init__(self):
+        super(_Encoder, self).__init__()
+        self.classes = _serialClasses()
+        self.strings = {}
+        self.string_list = []
+        self.shapes = {}
+        self.shape_list = []
+        self.objects = {}
+        self.tags = []
+        self.u32s = []
+        self.ints = []
+        self.longs = []
+        self.floats = []
+
+    def string(self, value):
+        key = (type(value), value)
+        index = self.strings.get(key)
+        if index is None:
+            index = self.strings[key] = len(self.string_list)
+            self.string_list.append(value)
+        return index
+
+    def encode(self, value):
+        tags = self.tags
+        if value is None:
+            tags.append('N')
+        elif value is True:
+            tags.append('T')
+        elif value is False:
+            tags.append('F')
+        elif isinstance(value, basestring):
+            tags.append('s')
+            self.u32s.append(self.string(value))
+        elif isinstance(value, (int, long)):
+            if -0x80000000 <= value <= 0x7fffffff:
+                tags.append('i')
+                self.ints.append(value)
+            elif -0x8000000000000000 <= value <= 0x7fffffffffffffff:
+                tags.append('q')
+                self.longs.append(value)
+            else:
+                raise TypeError, "Can't serialize %r, which doesn't fit in 64 bits" % value
+        elif isinstance(value, float):
+            tags.append('f')
+            self.floats.append(value)
+        elif isinstance(value, (list, tuple)):
+            if isinstance(value, tuple):
+                tags.append('t')
+            else:
+                tags.append('l')
+            self.u32s.append(len(value))
+            for item in value:
+                self.encode(item)
+        elif isinstance(value, dict):
+            tags.append('d')
+            self.u32s.append(len(value))
+            for key, item in value.iteritems():
+                self.encode(key)
+                self.encode(item)
+        else:
+            self.encodeObject(value)
+
+    def encodeObject(self, obj):
+        ref = self.objects.get(id(obj))
+        if ref is not None:
+            self.tags.append('r')
+            self.u32s.append(ref[0])
+            return
+        cls = type(obj)
+        if self.classes.get(cls.__name__) is not cls:
+            raise TypeError, "Can't serialize %r" % cls
+        # Keeping the object alive keeps its id from being reused
+        self.objects[id(obj)] = (len(self.objects), obj)
+        state = _objectState(obj)
+        names = tuple(sorted(state))
+        key = (cls.__name__, names)
+        shape = self.shapes.get(key)
+        if shape is None:
+            shape = self.shapes[key] = len(self.shape_list)
+            self.shape_list.append(key)
+        self.tags.append('o')
+        self.u32s.append(shape)
+        for name in names:
+            self.encode(state[name])
+
+    def getvalue(self):
+        shapes = [ _U32.pack(len(self.shape_list)) ]
+        for cls_name, names in self.shape_list:
+            shapes.append(struct.pack('<%dI' % (len(names) + 2), self.string(cls_name), 
+                                      len(names), *[ self.string(name) for name in names ]))
+        kinds = []
+        values = []
+        for value in self.string_list:
+            if isinstance(value, unicode):
+                kinds.append('\x01')
+                values.append(value.encode('utf-8'))
+            else:
+                kinds.append('\x00')
+                values.append(value)
+        strings = [ _U32.pack(len(values)), ''.join(kinds), 
+                    struct.pack('<%dI' % len(values), *[ len(v) for v in values ]), ''.join(values) ]
+        streams = [
+            _U32.pack(len(self.tags)), ''.join(self.tags),
+            _U32.pack(len(self.u32s)), struct.pack('<%dI' % len(self.u32s), *self.u32s),
+            _U32.pack(len(self.ints)), struct.pack('<%di' % len(self.ints), *self.ints),
+            _U32.pack(len(self.longs)), struct.pack('<%dq' % len(self.longs), *self.longs),
+            _U32.pack(len(self.floats)), struct.pack('<%dd' % len(self.floats), *self.floats)
+        ]
+        return ''.join([ SERIAL_MAGIC, _U8.pack(SERIAL_VERSION) ] + strings + shapes + streams)
+
+
+class _Decoder(object):
+    def __init__(self, data):
+        super(_Decoder, self).__init__()
+        self.data = data
+        self.offset = 0
+
+    def u32(self):
+        value = _U32.unpack_from(self.data, self.offset)[0]
+        self.offset += 4
+        return value
+
+    def chunk(self, length):
+        value = self.data[self.offset:self.offset + length]
+        if len(value) != length:
+            raise TumblrParseError, "Serialized data is truncated"
+        self.offset += length
+        return value
+
+    def stream(self, code, size):
+        count = self.u32()
+        return struct.unpack('<%d%s' % (count, code), self.chunk(count * size))
+
+    def decode(self):
+        data = self.data
+        if data[:len(SERIAL_MAGIC)] != SERIAL_MAGIC:
+            raise TumblrParseError, "Not serialized Tumblr data"
+        self.offset = len(SERIAL_MAGIC)
+        version = _U8.unpack(self.chunk(1))[0]
+        if version != SERIAL_VERSION:
+            raise TumblrParseError, "Unsupported serialization version %d" % version
+        count = self.u32()
+        kinds = self.chunk(count)
+        lengths = struct.unpack('<%dI' % count, self.chunk(count * 4))
+        blob = self.chunk(sum(lengths))
+        strings = []
+        start = 0
+        for kind, length in zip(kinds, lengths):
+            value = blob[start:start + length]
+            start += length
+            if kind != '\x00':
+                value = unicode(value, 'utf-8')
+            strings.append(value)
+        classes = _serialClasses()
+        shapes = []
+        for i in xrange(self.u32()):
+            cls_name = strings[self.u32()]
+            try:
+                cls = classes[cls_name]
+            except KeyError:
+                raise TumblrParseError, "Unknown class %s in serialized data" % cls_name
+            names = [ str(strings[index]) for index in self.stream('I', 4) ]
+            shapes.append((cls, names, issubclass(cls, _Compact)))
+        tags = self.chunk(self.u32())
+        next_tag = iter(tags).next
+        next_u32 = iter(self.stream('I', 4)).next
+        next_int = iter(self.stream('i', 4)).next
+        next_long = iter(self.stream('q', 8)).next
+        next_float = iter(self.stream('d', 8)).next
+        objects = []
+
+        def decode():
+            tag = next_tag()
+            if tag == 's':
+                return strings[next_u32()]
+            if tag == 'i':
+                return next_int()
+            if tag == 'N':
+                return None
+            if tag == 'o':
+                cls, names, slotted = shapes[next_u32()]
+                obj = cls.__new__(cls)
+                objects.append(obj)
+                if slotted:
+                    # Setting attributes directly is quicker than building 
+                    # a dict for __setstate__()
+                    for name in names:
+                        setattr(obj, name, decode())
+                    if isinstance(obj, Post):
+                        obj.postdata = None
+                else:
+                    d = obj.__dict__
+                    for name in names:
+                        d[name] = decode()
+                    if isinstance(obj, (Tumblelog, NotModified)):
+                        obj.http_response = None
+                return obj
+            if tag == 'q':
+                return next_long()
+            if tag == 'r':
+                return objects[next_u32()]
+            if tag == 'T':
+                return True
+            if tag == 'F':
+                return False
+            if tag == 'f':
+                return next_float()
+            if tag == 'l':
+                return [ decode() for i in xrange(next_u32()) ]
+            if tag == 't':
+                return tuple([ decode() for i in xrange(next_u32()) ])
+            if tag == 'd':
+                d = {}
+                for i in xrange(next_u32()):
+                    key = decode()
+                    d[key] = decode()
+                return d
+            raise TumblrParseError, "Bad tag %r in serialized data" % tag
+        return decode()
+
+
+def dumps(value):
+    """Serializes parsed results into a compact binary string.
+    
+    Accepts Tumblelogs, NotModified results, posts, feeds, conversation 
+    lines and AuthInfo objects, as well as strings, numbers, None and 
+    lists, tuples and dicts of any of these.  As with pickling, posts 
+    leave out their postdata, and Tumblelogs their http_response.  
+    Repeated strings, such as URLs and post types, are only written once.
+    
+    >>> data = tumblr.dumps(tumblr.parse(url))
+    >>> log = tumblr.loads(data)
+    """
+    encoder = _Encoder()
+    encoder.encode(value)
+    return encoder.getvalue()
+
+def loads(data):
+    """Reads back a value serialized by dumps().  Raises TumblrParseError 
+    if the data isn't in a format this version can read."""
+    try:
+        return _Decoder(data).decode()
+    except (struct.error, IndexError, StopIteration):
+        raise TumblrParseError, "Serialized data is truncated"
+    except (UnicodeError, ValueError, AttributeError, TypeError, KeyError), e:
+        # Such as a string that isn't UTF-8, or a field the class lacks
+        raise TumblrParseError, "Serialized data is corrupt: %s" % e
+    except RuntimeError:
+        # Lists nested deeper than the recursion limit
+        raise TumblrParseError, "Serialized data is nested too deeply"
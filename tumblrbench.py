@@ -0,0 +1,462 @@
+#!/usr/bin/env python
+"""Tumblr API client benchmarks
+
+Everything runs offline, against the XML files in the tests directory and
+against generated pages of 50, 500 and 50,000 posts.  For parse(),
+_getTree(), loads() and each Post subclass constructor, reports:
+
+- posts per second (the median of several runs)
+- how far the peak RSS of the process that ran the benchmark rose over
+  what it started with, input included
+- the number of objects left allocated by one call
+
+Each benchmark runs in a process of its own where possible, and builds its
+input there, so that neither the other benchmarks nor their inputs count
+towards its RSS.
+
+It also times how long "python -c 'import tumblr'" takes, over and above
+starting the interpreter at all.
+
+--compare flags a benchmark as slower only if its median is more than
+the threshold below the baseline's median, and stays that way when it is
+run again RECHECKS more times.
+
+Usage:
+    python tumblrbench.py                     Run everything
+    python tumblrbench.py --quick             Skip the 50,000 post page
+    python tumblrbench.py --save base.json    Save the results as a baseline
+    python tumblrbench.py --compare base.json Fail if slower than a baseline
+"""
+
+__author__ = "SNF Labs"
+
+import os
+import sys
+import gc
+import glob
+import time
+import timeit
+import shutil
+import tempfile
+import traceback
+import subprocess
+from optparse import OptionParser
+try:
+    import json
+except ImportError:
+    import simplejson as json
+try:
+    import resource
+except ImportError:
+    resource = None
+import tumblr
+
+TESTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tests')
+GENERATED_SIZES = (50, 500, 50000)
+# How long to keep calling a benchmark for each timed run, in seconds
+MIN_RUN_TIME = 0.2
+# How many timed runs to take the median of
+REPEATS = 5
+# How many times to run a benchmark that looks slower again before 
+# calling it a regression
+RECHECKS = 2
+DEFAULT_THRESHOLD = 0.1
+# How many fresh interpreters to time the import in
+IMPORT_RUNS = 20
+
+def _read(path, mode='r'):
+    f = open(path, mode)
+    try:
+        return f.read()
+    finally:
+        f.close()
+
+def _fixture(*path):
+    """Returns the contents of an XML file in the tests directory."""
+    return _read(os.path.join(TESTS_DIR, *path))
+
+def _fixturePost(type):
+    """Returns the first post of the given type from the demo tumblelog."""
+    for post in tumblr.parse(_fixture('tumblelog', 'demo.xml')).posts:
+        if post.type == type:
+            return post
+
+def _fixtures():
+    """Returns (name, xml) tuples for the tumblelog XML in the tests
+    directory."""
+    paths = glob.glob(os.path.join(TESTS_DIR, 'tumblelog', '*.xml'))
+    paths.sort()
+    paths.append(os.path.join(TESTS_DIR, 'file', 'golden.xml'))
+    fixtures = []
+    for path in paths:
+        name = os.path.splitext(os.path.basename(path))[0]
+        fixtures.append((name, _read(path)))
+    return fixtures
+
+# The demo tumblelog has no video or audio posts
+EXTRA_POSTS = (
+    '<post id="0" url="http://demo.tumblr.com/post/0" type="video" '
+    'date-gmt="2007-12-05 19:01:02 GMT" date="Wed, 05 Dec 2007 14:01:02" unix-timestamp="1196881262">'
+    '<video-source>http://www.youtube.com/watch?v=2fZHou18Cdk</video-source>'
+    '<video-player>&lt;embed src="http://www.youtube.com/v/2fZHou18Cdk" width="400" height="336"&gt;&lt;/embed&gt;</video-player>'
+    '<video-caption>A &lt;b&gt;video&lt;/b&gt; caption</video-caption></post>',
+    '<post id="0" url="http://demo.tumblr.com/post/0" type="audio" '
+    'date-gmt="2007-12-05 19:01:02 GMT" date="Wed, 05 Dec 2007 14:01:02" unix-timestamp="1196881262">'
+    '<audio-player>&lt;embed src="http://demo.tumblr.com/audio_player.swf" width="207" height="27"&gt;&lt;/embed&gt;</audio-player>'
+    '<audio-caption>An &lt;i&gt;audio&lt;/i&gt; caption</audio-caption></post>'
+)
+
+def generate_page(num_posts, all_types=False):
+    """Returns Tumblr API XML for a page of num_posts posts, made by
+    cycling through the posts of the demo tumblelog and giving each copy
+    an id of its own.  If all_types is True, video and audio posts are 
+    mixed in as well, so that every built-in post type is present."""
+    tree = tumblr.ElementTree.fromstring(_fixture('tumblelog', 'demo.xml'))
+    posts = tree.find('posts')
+    templates = list(posts)
+    for post in templates:
+        posts.remove(post)
+    if all_types:
+        templates.extend([ tumblr.ElementTree.fromstring(xml) for xml in EXTRA_POSTS ])
+    for i in range(num_posts):
+        post = tumblr.ElementTree.fromstring(tumblr.ElementTree.tostring(templates[i % len(templates)]))
+        post.set('id', str(num_posts - i))
+        posts.append(post)
+    posts.set('total', str(num_posts))
+    return tumblr.ElementTree.tostring(tree)
+
+def _pages(quick=False):
+    """Returns (name, xml) tuples for every page to benchmark."""
+    pages = _fixtures()
+    for size in GENERATED_SIZES:
+        if quick and size > 1000:
+            continue
+        pages.append(('generated-%d' % size, generate_page(size)))
+    return pages
+
+
+class BenchmarkError(Exception): pass
+
+def _median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2.0
+
+def _medianTime(func, repeats=REPEATS):
+    """Returns the median time, in seconds, of a call to func over 
+    several runs, each calling it for at least MIN_RUN_TIME seconds."""
+    loops = 1
+    while True:
+        start = time.time()
+        for i in range(loops):
+            func()
+        elapsed = time.time() - start
+        if elapsed >= MIN_RUN_TIME:
+            break
+        loops *= 2
+    times = []
+    for run in range(repeats):
+        start = time.time()
+        for i in range(loops):
+            func()
+        times.append((time.time() - start) / loops)
+    return _median(times)
+
+def _maxRss():
+    """Returns the peak RSS of this process so far, in KB, or None."""
+    if resource is None:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def _measure(setup):
+    """Sets up a benchmark, runs it and returns its results as a dict."""
+    start_rss = _maxRss()
+    func, num_posts = setup()
+    # Warm up first, so that one-off allocations don't skew the count
+    func()
+    gc.collect()
+    before = len(gc.get_objects())
+    kept = func()
+    gc.collect()
+    objects = len(gc.get_objects()) - before
+    del kept
+    seconds = _medianTime(func)
+    results = {
+        'posts_per_sec': num_posts / seconds,
+        'objects': objects,
+        'peak_rss_kb': None
+    }
+    if start_rss is not None:
+        # A forked process starts out with its parent's RSS
+        results['peak_rss_kb'] = _maxRss() - start_rss
+    return results
+
+def _runApart(name, func):
+    """Calls func in a process of its own where possible, and returns 
+    what it returns, which must be JSON serializable.  Raises 
+    BenchmarkError, with the child's traceback, if it fails."""
+    if not hasattr(os, 'fork'):
+        return func()
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_fd)
+        status = 1
+        try:
+            try:
+                message = { 'results': func() }
+                status = 0
+            except:
+                message = { 'error': traceback.format_exc() }
+            data = json.dumps(message)
+            while data:
+                data = data[os.write(write_fd, data):]
+        finally:
+            # Never return into the parent's code, whatever happened
+            os._exit(status)
+    os.close(write_fd)
+    chunks = []
+    while True:
+        chunk = os.read(read_fd, 4096)
+        if not chunk:
+            break
+        chunks.append(chunk)
+    os.close(read_fd)
+    status = os.waitpid(pid, 0)[1]
+    try:
+        message = json.loads(''.join(chunks))
+    except ValueError:
+        if os.WIFSIGNALED(status):
+            how = "was killed by signal %d" % os.WTERMSIG(status)
+        else:
+            how = "exited with status %d" % os.WEXITSTATUS(status)
+        raise BenchmarkError, "%s: the benchmark process %s" % (name, how)
+    if 'error' in message:
+        raise BenchmarkError, "%s failed:\n%s" % (name, message['error'])
+    return message['results']
+
+def _measureApart(name, setup):
+    """Sets up and runs a benchmark in a process of its own where 
+    possible, so that its peak RSS isn't hidden by the benchmarks that 
+    ran before it, or by their inputs."""
+    return _runApart(name, lambda: _measure(setup))
+
+
+def bench_import(runs=IMPORT_RUNS):
+    """Times importing tumblr in fresh interpreters.  Returns the median 
+    time in milliseconds, less the median time to start the interpreter 
+    and do nothing."""
+    here = os.path.dirname(os.path.abspath(__file__))
+    def median(statement):
+        times = []
+        for i in range(runs):
+            start = time.time()
+            subprocess.call([ sys.executable, '-c', statement ], cwd=here)
+            times.append(time.time() - start)
+        return _median(times)
+    return max(0, median('import tumblr') - median('pass')) * 1000
+
+def _prepare(quick, directory):
+    """Writes each page to benchmark, and its dumps() encoding, to files 
+    in directory.  Returns the (name, num_posts) of each page."""
+    pages = []
+    for name, xml in _pages(quick):
+        path = os.path.join(directory, name)
+        for suffix, data in (('.xml', xml), ('.dump', tumblr.dumps(tumblr.parse(xml)))):
+            f = open(path + suffix, 'wb')
+            try:
+                f.write(data)
+            finally:
+                f.close()
+        pages.append((name, xml.count('<post ')))
+    return pages
+
+def benchmarks(directory, quick=False):
+    """Returns (name, setup) tuples for every benchmark.
+
+    setup() is called in the process that runs the benchmark, and 
+    returns the function to time and the number of posts it handles.  
+    The pages are written to directory first, by a process of their 
+    own, so that this one never holds them."""
+    pages = _runApart('writing pages', lambda: _prepare(quick, directory))
+    cases = []
+    for name, num_posts in pages:
+        path = os.path.join(directory, name)
+        def parse(path=path, num_posts=num_posts):
+            xml = _read(path + '.xml')
+            return (lambda: tumblr.parse(xml)), num_posts
+        def getTree(path=path, num_posts=num_posts):
+            xml = _read(path + '.xml')
+            return (lambda: tumblr._getTree(xml)), num_posts
+        def loads(path=path, num_posts=num_posts):
+            data = _read(path + '.dump', 'rb')
+            return (lambda: tumblr.loads(data)), num_posts
+        cases.append(('parse %s' % name, parse))
+        cases.append(('_getTree %s' % name, getTree))
+        cases.append(('loads %s' % name, loads))
+    for type, constructor in sorted(tumblr.POST_TYPES.items()):
+        def construct(type=type, constructor=constructor):
+            tree = tumblr._getTree(generate_page(500, all_types=True))
+            elements = [ e for e in tree.find('posts') if e.attrib.get('type') == type ]
+            return (lambda: [ constructor(e, False) for e in elements ]), len(elements)
+        cases.append(('%s()' % constructor.__name__, construct))
+    return cases
+
+def run(cases, out=sys.stdout):
+    """Runs the benchmarks from benchmarks(), printing the results as 
+    they come in.
+
+    Returns a dict of results keyed by benchmark name."""
+    results = {}
+    out.write("%-32s %14s %12s %10s\n" % ('benchmark', 'posts/sec', 'RSS rise MB', 'objects'))
+    for name, setup in cases:
+        r = _measureApart(name, setup)
+        results[name] = r
+        if r['peak_rss_kb'] is None:
+            rss = 'n/a'
+        else:
+            rss = '%.1f' % (r['peak_rss_kb'] / 1024.0)
+        out.write("%-32s %14.0f %12s %10d\n" % (name, r['posts_per_sec'], rss, r['objects']))
+        out.flush()
+    import_ms = bench_import()
+    results['import tumblr'] = { 'import_ms': import_ms }
+    out.write("%-32s %11.1f ms\n" % ('import tumblr', import_ms))
+    return results
+
+def _speed(result):
+    """Returns how fast a benchmark ran, in units where more is better."""
+    if 'import_ms' in result:
+        # Guard against an import too quick to measure
+        return 1.0 / max(result['import_ms'], 0.1)
+    return result['posts_per_sec']
+
+def compare(results, baseline, threshold=DEFAULT_THRESHOLD, out=sys.stdout, recheck=None):
+    """Compares results against a baseline.  Returns the names of the
+    benchmarks whose median got more than threshold (a fraction) slower.
+
+    If recheck is given, it is called with the name of a benchmark that 
+    looks slower to measure it afresh, up to RECHECKS times, and the 
+    benchmark only counts as slower if it is every time.  One slow 
+    process is more often noise than a real slowdown."""
+    regressions = []
+    names = [ n for n in results if n in baseline ]
+    names.sort()
+    for name in names:
+        ratio = _speed(results[name]) / _speed(baseline[name])
+        rechecks = 0
+        while ratio < 1 - threshold and recheck is not None and rechecks < RECHECKS:
+            ratio = max(ratio, _speed(recheck(name)) / _speed(baseline[name]))
+            rechecks += 1
+        flag = ''
+        if ratio < 1 - threshold:
+            flag = '  REGRESSION'
+            regressions.append(name)
+        elif rechecks:
+            flag = '  (rechecked)'
+        out.write("%-32s %+7.1f%%%s\n" % (name, (ratio - 1) * 100, flag))
+    return regressions
+
+def _recheck(cases):
+    """Returns a function that measures one of the benchmarks from 
+    benchmarks() again by name."""
+    setups = dict(cases)
+    def recheck(name):
+        if name == 'import tumblr':
+            return { 'import_ms': bench_import() }
+        return _measureApart(name, setups[name])
+    return recheck
+
+
+class _GetattrRegular(object):
+    """A Regular post that resolves its aliases through __getattr__, the
+    way posts did before aliases became class attributes.  Only used as
+    a point of comparison."""
+    def __init__(self, post):
+        super(_GetattrRegular, self).__init__()
+        self._keymap = {
+            'permalink': 'url',
+            'content': 'body',
+            'description': 'body'
+        }
+        self.url = post.url
+        self.body = post.body
+
+    def __getattr__(self, attr):
+        try:
+            return self.__dict__[attr]
+        except KeyError:
+            pass
+        try:
+            return self.__dict__[self._keymap[attr]]
+        except:
+            raise AttributeError, "object has no attribute '%s'" % attr
+
+
+def bench_aliases(number=1000000):
+    """Times alias reads (post.content) against plain attribute reads
+    (post.body) and against the old __getattr__ alias lookup.
+
+    Returns a list of (name, nanoseconds per read) tuples."""
+    setup = "import tumblrbench; post = tumblrbench._fixturePost('regular')"
+    legacy = setup + "; post = tumblrbench._GetattrRegular(post)"
+    cases = [
+        ('post.body (attribute)', "post.body", setup),
+        ('post.content (alias)', "post.content", setup),
+        ('post.content (__getattr__)', "post.content", legacy)
+    ]
+    results = []
+    for name, stmt, case_setup in cases:
+        seconds = min(timeit.Timer(stmt, case_setup).repeat(3, number))
+        results.append((name, seconds / number * 1e9))
+    return results
+
+
+def main():
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    parser = OptionParser(usage="%prog [options]")
+    parser.add_option("--quick", action="store_true", default=False,
+                      help="skip the largest generated page")
+    parser.add_option("--save", metavar="FILE",
+                      help="save the results as a baseline")
+    parser.add_option("--compare", metavar="FILE",
+                      help="compare the results against a saved baseline")
+    parser.add_option("--threshold", type="float", default=DEFAULT_THRESHOLD,
+                      help="slowdown that counts as a regression [default: %default]")
+    parser.add_option("--aliases", action="store_true", default=False,
+                      help="also time alias attribute reads")
+    options, args = parser.parse_args()
+    directory = tempfile.mkdtemp()
+    try:
+        cases = benchmarks(directory, options.quick)
+        results = run(cases)
+        _report(options, results, cases)
+    finally:
+        shutil.rmtree(directory)
+
+def _report(options, results, cases):
+    if options.aliases:
+        print
+        print "Alias reads"
+        for name, ns in bench_aliases():
+            print "  %-30s %8.1f ns/read" % (name, ns)
+    if options.save:
+        f = open(options.save, 'w')
+        try:
+            json.dump(results, f, indent=2, sort_keys=True)
+        finally:
+            f.close()
+    if options.compare:
+        f = open(options.compare, 'r')
+        try:
+            baseline = json.load(f)
+        finally:
+            f.close()
+        print
+        print "Compared with %s" % options.compare
+        if compare(results, baseline, options.threshold, recheck=_recheck(cases)):
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,304 @@
+#!/usr/bin/env python
+"""A local stand-in for the Tumblr API, for testing without tumblr.com
+
+Serves the XML files in the tests directory, and acts out the network
+conditions that NetworkingTestCase otherwise needs a real web server
+(and the PHP scripts in tests/http) for:
+
+- /api/read and /<name>/api/read serve tests/tumblelog/<name>.xml
+  (demo by default), honoring the start, num and type parameters.
+  /generated-<N>/api/read serves a tumblelog of N generated posts.
+- /api/authenticate answers for any email with the password "secret",
+  and with 403 Forbidden otherwise.
+- /http/errors/<code> answers with that HTTP status.
+- /http/redirects/301, 302 and 307 redirect to /http/redirects/demo.xml.
+- /http/contenttype/?type=... sets the content type, as the PHP does.
+- Any other path is served from the tests directory.
+
+Every XML response carries an ETag and a Last-Modified header, and
+conditional requests get 304 Not Modified.  Any request also accepts:
+
+- latency=<seconds> to wait before answering
+- fail=<n> to fail the first n requests for the same URL, with
+  fail_status=<code> (503 by default) and retry_after=<seconds>
+
+The server handles each connection in a thread of its own and keeps
+connections alive.
+
+    >>> server = tumblrserver.TumblrServer().start()
+    >>> log = tumblr.parse(server.url + "/api/read")
+    >>> server.stop()
+
+Or, from the command line:
+
+    python tumblrserver.py --port 8000 --latency 0.05
+"""
+
+__author__ = "SNF Labs"
+
+import os
+import re
+import time
+import socket
+import hashlib
+import threading
+import urlparse
+from optparse import OptionParser
+from email.utils import formatdate
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from SocketServer import ThreadingMixIn
+import tumblr
+from tumblrbench import generate_page
+
+TESTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tests')
+PASSWORD = "secret"
+CONTENT_TYPES = {
+    'applicationxml': 'application/xml',
+    'applicationxhtmlxml': 'application/xhtml+xml',
+    'texthtml': 'text/html',
+    'textxml': 'text/xml'
+}
+
+_READ_PATH = re.compile(r'^/(?:([\w.-]+)/)?api/read/?$')
+_ERROR_PATH = re.compile(r'^/http/errors/(\d+)/?$')
+_REDIRECT_PATH = re.compile(r'^/http/redirects/(301|302|307)$')
+
+
+class TumblrRequestHandler(BaseHTTPRequestHandler):
+    """Answers requests the way the Tumblr API would."""
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+    def do_GET(self):
+        # The handler lives as long as the connection, so don't let a 
+        # previous request's body linger
+        self.body = None
+        self._handle()
+
+    def do_POST(self):
+        length = int(self.headers.get('content-length') or 0)
+        self.body = self.rfile.read(length)
+        self._handle()
+
+    def _handle(self):
+        url = urlparse.urlparse(self.path)
+        path = url[2]
+        params = dict([ (k, v[-1]) for k, v in urlparse.parse_qs(url[4]).items() ])
+        if self.body:
+            for k, v in urlparse.parse_qs(self.body).items():
+                params.setdefault(k, v[-1])
+        latency = self.server.latency + float(params.get('latency', 0))
+        if latency > 0:
+            time.sleep(latency)
+        if 'fail' in params and self.server.count(self.path) <= int(params['fail']):
+            headers = {}
+            if 'retry_after' in params:
+                headers['Retry-After'] = params['retry_after']
+            return self._error(int(params.get('fail_status', 503)), headers)
+        m = _READ_PATH.match(path)
+        if m:
+            return self._read(m.group(1) or 'demo', params)
+        if path.rstrip('/') == '/api/authenticate':
+            return self._authenticate(params)
+        m = _ERROR_PATH.match(path)
+        if m:
+            return self._error(int(m.group(1)))
+        m = _REDIRECT_PATH.match(path)
+        if m:
+            return self._send(int(m.group(1)), '', 'text/plain',
+                              { 'Location': '/http/redirects/demo.xml' })
+        if path.rstrip('/') == '/http/contenttype':
+            content_type = CONTENT_TYPES.get(params.get('type', 'textxml'), 'text/plain')
+            return self._xml(self.server.fixture('http', 'contenttype', 'demo.xml'),
+                             content_type + '; charset=utf-8')
+        return self._static(path)
+
+    def _read(self, name, params):
+        m = re.match(r'^generated-(\d+)$', name)
+        if m:
+            xml = self.server.generated(int(m.group(1)))
+        else:
+            xml = self.server.fixture('tumblelog', name + '.xml')
+        if xml is None:
+            return self._error(404)
+        start = int(params.get('start', 0))
+        num = int(params.get('num', 20))
+        tree = tumblr.ElementTree.fromstring(xml)
+        posts = tree.find('posts')
+        matching = [ p for p in posts
+                     if params.get('type') in (None, p.attrib.get('type')) ]
+        for post in list(posts):
+            posts.remove(post)
+        for post in matching[start:start + num]:
+            posts.append(post)
+        posts.set('start', str(start))
+        posts.set('total', str(len(matching)))
+        xml = '<?xml version="1.0" encoding="UTF-8"?>\n' + tumblr.ElementTree.tostring(tree)
+        return self._xml(xml)
+
+    def _authenticate(self, params):
+        if self.command != 'POST':
+            return self._error(400)
+        if params.get('password') != PASSWORD:
+            return self._error(403)
+        return self._xml(self.server.fixture('authenticate', 'authenticate.xml'))
+
+    def _static(self, path):
+        parts = [ p for p in path.split('/') if p and p not in ('.', '..') ]
+        xml = self.server.fixture(*parts)
+        if xml is None:
+            return self._error(404)
+        return self._xml(xml)
+
+    def _xml(self, xml, content_type='text/xml; charset=utf-8'):
+        etag = '"%s"' % hashlib.sha1(xml).hexdigest()
+        last_modified = formatdate(self.server.started, usegmt=True)
+        headers = { 'ETag': etag, 'Last-Modified': last_modified }
+        if self.headers.get('if-none-match') == etag or \
+           (self.headers.get('if-none-match') is None and
+            self.headers.get('if-modified-since') == last_modified):
+            return self._send(304, None, None, headers)
+        return self._send(200, xml, content_type, headers)
+
+    def _error(self, code, headers=None):
+        return self._send(code, "HTTP %d" % code, 'text/plain', headers)
+
+    def _send(self, code, body, content_type, headers=None):
+        self.send_response(code)
+        if content_type is not None:
+            self.send_header('Content-Type', content_type)
+        if body is not None:
+            self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        if body and self.command != 'HEAD':
+            self.wfile.write(body)
+
+
+class TumblrServer(ThreadingMixIn, HTTPServer):
+    """A threaded local stand-in for the Tumblr API.
+
+    Binds to a free port unless told otherwise; see the url attribute.
+    Every request waits at least latency seconds before it is answered.
+
+    Attributes:
+    - url
+    - latency
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0, root=TESTS_DIR, verbose=False):
+        HTTPServer.__init__(self, (host, port), TumblrRequestHandler)
+        self.latency = latency
+        self.root = root
+        self.verbose = verbose
+        self.started = time.time()
+        self.url = "http://%s:%d" % self.server_address
+        self._lock = threading.Lock()
+        self._counts = {}
+        self._generated = {}
+        self._connections = set()
+        self._thread = None
+
+    def get_request(self):
+        connection, address = HTTPServer.get_request(self)
+        self._lock.acquire()
+        try:
+            self._connections.add(connection)
+        finally:
+            self._lock.release()
+        return connection, address
+
+    def shutdown_request(self, request):
+        self._lock.acquire()
+        try:
+            self._connections.discard(request)
+        finally:
+            self._lock.release()
+        HTTPServer.shutdown_request(self, request)
+
+    def fixture(self, *path):
+        """Returns the contents of a file under the root, or None."""
+        try:
+            f = open(os.path.join(self.root, *path), 'rb')
+        except IOError:
+            return None
+        try:
+            return f.read()
+        finally:
+            f.close()
+
+    def generated(self, num_posts):
+        """Returns a generated page of num_posts posts."""
+        self._lock.acquire()
+        try:
+            if num_posts not in self._generated:
+                self._generated[num_posts] = generate_page(num_posts)
+            return self._generated[num_posts]
+        finally:
+            self._lock.release()
+
+    def count(self, key):
+        """Counts a request for the given key, returning how many there
+        have been so far."""
+        self._lock.acquire()
+        try:
+            self._counts[key] = self._counts.get(key, 0) + 1
+            return self._counts[key]
+        finally:
+            self._lock.release()
+
+    def start(self):
+        """Serves requests in a background thread.  Returns the server."""
+        self._thread = threading.Thread(target=self.serve_forever)
+        self._thread.setDaemon(True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stops a server started with start(), closing any connections 
+        that are being kept alive."""
+        self.shutdown()
+        self.server_close()
+        self._thread.join()
+        self._lock.acquire()
+        try:
+            for connection in list(self._connections):
+                try:
+                    connection.shutdown(socket.SHUT_RDWR)
+                except socket.error:
+                    pass
+        finally:
+            self._lock.release()
+        # Give the handler threads a moment to notice and finish
+        deadline = time.time() + 1
+        while self._connections and time.time() < deadline:
+            time.sleep(0.01)
+
+    def handle_error(self, request, client_address):
+        # Clients hanging up on kept-alive connections is business as usual
+        if self.verbose:
+            HTTPServer.handle_error(self, request, client_address)
+
+
+def main():
+    parser = OptionParser(usage="%prog [options]")
+    parser.add_option("--host", default="127.0.0.1")
+    parser.add_option("--port", type="int", default=8000)
+    parser.add_option("--latency", type="float", default=0,
+                      help="seconds to wait before each answer [default: %default]")
+    options, args = parser.parse_args()
+    server = TumblrServer(options.host, options.port, options.latency, verbose=True)
+    print "Serving the Tumblr API at %s" % server.url
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
@@ -9,12 +9,30 @@ __TODO__ = """TODO List
 """
 
 import os
+import time
+import atexit
 import unittest
 import tumblr
 import urlparse
+import threading
+import shutil
+import tempfile
+import zlib
 
 class WTFError(Exception): pass
 
+_local_server = None
+
+def local_server():
+    """Returns the URL of a local stand-in for the Tumblr API, starting it 
+    the first time."""
+    global _local_server
+    if _local_server is None:
+        import tumblrserver
+        _local_server = tumblrserver.TumblrServer().start()
+        atexit.register(_local_server.stop)
+    return _local_server.url
+
 def isUrl(str):
     """Attempts to determine if the given string is really an HTTP URL.
     
@@ -103,6 +121,872 @@ class FileOrStringTestCase(unittest.TestCase):
         assert log.title == 'golden hours'
 
 
+class FileInputTestCase(unittest.TestCase):
+    """Tests the kinds of file input that can be parsed."""
+    def setUp(self):
+        self.filename = os.path.join(os.getcwd(), 'tests', 'tumblelog', 'sourcefeeds.xml')
+        f = open(self.filename, 'r')
+        self.xmlString = f.read()
+        f.close()
+        self.ids = [ p.id for p in tumblr.parse(self.xmlString).posts ]
+        self.chunk_size = tumblr.CHUNK_SIZE
+        # Make sure that files take more than one chunk
+        tumblr.CHUNK_SIZE = 100
+
+    def tearDown(self):
+        tumblr.CHUNK_SIZE = self.chunk_size
+
+    def testPath(self):
+        """A file path can be passed to the parser."""
+        assert [ p.id for p in tumblr.parse(self.filename).posts ] == self.ids
+        assert [ p.id for p in list(tumblr.iterparse(self.filename))[1:] ] == self.ids
+
+    def testFileLike(self):
+        """A file-like object can be passed to the parser."""
+        from StringIO import StringIO
+        assert [ p.id for p in tumblr.parse(StringIO(self.xmlString)).posts ] == self.ids
+
+    def testMmap(self):
+        """A memory-mapped file can be passed to the parser."""
+        import mmap
+        f = open(self.filename, 'rb')
+        m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            assert [ p.id for p in tumblr.parse(m).posts ] == self.ids
+            m.seek(0)
+            assert [ p.id for p in list(tumblr.iterparse(m))[1:] ] == self.ids
+        finally:
+            m.close()
+            f.close()
+
+    def testFileParseCache(self):
+        """Files are identified by their content in the parse cache."""
+        cache = tumblr.MemoryCache()
+        f = open(self.filename, 'rb')
+        log = tumblr.parse(f, parse_cache=cache)
+        f.close()
+        assert tumblr.parse(self.filename, parse_cache=cache).posts is log.posts
+        assert tumblr.parse(self.xmlString, parse_cache=cache).posts is log.posts
+
+    def testMalformedFile(self):
+        """Error thrown if a file's XML is not well-formed."""
+        try:
+            tumblr.parse(os.path.join(os.getcwd(), 'tests', 'xml', 'malformed.xml'))
+        except tumblr.TumblrParseError:
+            pass
+        else:
+            self.fail("Expected a TumblrParseError for malformed XML!")
+
+
+class IterparseTestCase(unittest.TestCase):
+    """Tests the incremental parser."""
+    def setUp(self):
+        self.filename = os.path.join(os.getcwd(), 'tests', 'tumblelog', 'sourcefeeds.xml')
+        f = open(self.filename, 'r')
+        self.log = tumblr.parse(f)
+        f.close()
+
+    def testTumblelogFirst(self):
+        """The first object yielded is the Tumblelog."""
+        f = open(self.filename, 'r')
+        items = list(tumblr.iterparse(f))
+        f.close()
+        assert isinstance(items[0], tumblr.Tumblelog)
+        assert items[0].num_posts == self.log.num_posts
+        assert items[0].start == self.log.start
+
+    def testSamePostsAsParse(self):
+        """The incremental parser finds the same posts as parse()."""
+        f = open(self.filename, 'r')
+        xmlString = f.read()
+        f.close()
+        posts = list(tumblr.iterparse(xmlString))[1:]
+        assert [ p.id for p in posts ] == [ p.id for p in self.log.posts ]
+        assert [ p.type for p in posts ] == [ p.type for p in self.log.posts ]
+        assert posts[3].source_feed.id == 48612
+
+    def testElementsDropped(self):
+        """Posts don't hold on to their cleared elements."""
+        f = open(self.filename, 'r')
+        for item in tumblr.iterparse(f):
+            if isinstance(item, tumblr.Post):
+                assert item.postdata is None
+        f.close()
+
+    def testMalformedXML(self):
+        """Error thrown if XML is not well-formed."""
+        xmlString = '<tumblr version="1.0"><tumblelog name="test"></tumblr>'
+        try:
+            list(tumblr.iterparse(xmlString))
+        except tumblr.TumblrParseError:
+            pass
+        else:
+            self.fail("Expected a TumblrParseError for malformed XML!")
+
+
+class CompactPostTestCase(unittest.TestCase):
+    """Tests the slotted post objects and their aliases."""
+    def setUp(self):
+        f = open(os.path.join(os.getcwd(), 'tests', 'tumblelog', 'demo.xml'), 'r')
+        self.xmlString = f.read()
+        f.close()
+        self.log = tumblr.parse(self.xmlString)
+
+    def testNoInstanceDict(self):
+        """Posts, lines and feeds have no per-instance dict."""
+        for post in self.log.posts:
+            assert not hasattr(post, '__dict__')
+        assert not hasattr(tumblr.Line(u'a', u'b', u'c'), '__dict__')
+        assert not hasattr(tumblr.Feed(1, u'', u'', u'', 0), '__dict__')
+
+    def testAliases(self):
+        """Aliases still resolve to their attributes."""
+        quote, photo, link, conversation, regular = self.log.posts
+        assert quote.permalink == quote.url
+        assert quote.content == quote.quote
+        assert photo.description == photo.caption
+        assert link.body == link.description and link.related == link.link_url
+        assert conversation.content == conversation.description
+        assert regular.description == regular.body
+
+    def testUnknownAttribute(self):
+        """Unknown attributes raise AttributeError."""
+        try:
+            self.log.posts[0].related
+        except AttributeError:
+            pass
+        else:
+            self.fail("Expected an AttributeError!")
+
+    def testKeepPostdata(self):
+        """The XML elements can be dropped after parsing."""
+        assert self.log.posts[0].postdata is not None
+        log = tumblr.parse(self.xmlString, keep_postdata=False)
+        for post in log.posts:
+            assert post.postdata is None
+
+    def testPickle(self):
+        """Slotted objects can be pickled with every protocol."""
+        import pickle
+        log = tumblr.parse(self.xmlString, keep_postdata=False)
+        for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+            conversation = pickle.loads(pickle.dumps(log.posts[3], protocol))
+            assert conversation.id == log.posts[3].id
+            assert conversation.content == log.posts[3].content
+            assert conversation.lines[0].name == log.posts[3].lines[0].name
+
+
+class LazyPostTestCase(unittest.TestCase):
+    """Tests lazily parsed posts."""
+    def setUp(self):
+        f = open(os.path.join(os.getcwd(), 'tests', 'tumblelog', 'demo.xml'), 'r')
+        self.xmlString = f.read()
+        f.close()
+        self.log = tumblr.parse(self.xmlString)
+        self.lazy = tumblr.parse(self.xmlString, lazy=True, keep_postdata=False)
+
+    def setFields(self, post):
+        return tumblr._Compact.__getstate__(post)
+
+    def testCommonAttributes(self):
+        """Common attributes are parsed up front."""
+        for post in self.lazy.posts:
+            assert 'id' in self.setFields(post)
+            assert 'unixtime' in self.setFields(post)
+
+    def testFieldsDeferred(self):
+        """Fields are only parsed when first read, and then kept."""
+        regular = self.lazy.posts[4]
+        assert 'body' not in self.setFields(regular)
+        regular.content
+        assert 'body' in self.setFields(regular)
+        assert 'title' not in self.setFields(regular)
+
+    def testSameValues(self):
+        """Lazy posts have the same values as eagerly parsed ones."""
+        for eager, lazy in zip(self.log.posts, self.lazy.posts):
+            for name in eager._fields:
+                if name == 'lines':
+                    assert [ l.content for l in getattr(lazy, name) ] == [ l.content for l in getattr(eager, name) ]
+                else:
+                    assert getattr(lazy, name) == getattr(eager, name)
+
+
+class CacheTestCase(unittest.TestCase):
+    """Tests the cache backends."""
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def testNoCache(self):
+        """NoCache doesn't store anything."""
+        cache = tumblr.NoCache()
+        cache.set('a', 'A')
+        assert cache.get('a') is None
+
+    def testMemoryCacheLRU(self):
+        """The least recently used entry is dropped first."""
+        cache = tumblr.MemoryCache(2)
+        cache.set('a', 'A')
+        cache.set('b', 'B')
+        cache.get('a')
+        cache.set('c', 'C')
+        assert cache.get('a') == 'A' and cache.get('b') is None and cache.get('c') == 'C'
+        assert len(cache) == 2
+
+    def testMemoryCacheTTL(self):
+        """Expired entries aren't returned."""
+        cache = tumblr.MemoryCache(2, ttl=-1)
+        cache.set('a', 'A')
+        assert cache.get('a') is None and len(cache) == 0
+
+    def testMemoryCacheDelete(self):
+        """Entries can be deleted."""
+        cache = tumblr.MemoryCache(2)
+        cache.set('a', 'A')
+        cache.delete('a')
+        cache.delete('b')
+        assert cache.get('a') is None
+
+    def testDiskCacheEviction(self):
+        """A DiskCache stays under its size limit."""
+        cache = tumblr.DiskCache(self.directory, 25)
+        cache.set('http://example.com/a', 'A' * 10)
+        cache.set('http://example.com/b', 'B' * 10)
+        # Make sure 'a' was used less recently than 'b'
+        os.utime(cache._path('http://example.com/a'), (0, 0))
+        cache.set('http://example.com/c', 'C' * 10)
+        assert cache.get('http://example.com/a') is None
+        assert cache.get('http://example.com/b') == 'B' * 10
+        assert cache.get('http://example.com/c') == 'C' * 10
+
+    def testDiskCacheExistingSize(self):
+        """A DiskCache counts the entries already in its directory."""
+        tumblr.DiskCache(self.directory, 100).set('http://example.com/a', 'A' * 10)
+        assert tumblr.DiskCache(self.directory, 100)._size == 10
+
+    def testClientAcceptsCache(self):
+        """A Client can be given a cache object."""
+        cache = tumblr.MemoryCache()
+        assert tumblr.Client(cache=cache)._http().cache is cache
+
+
+class ParseCacheTestCase(unittest.TestCase):
+    """Tests the cache of parsed results."""
+    def setUp(self):
+        f = open(os.path.join(os.getcwd(), 'tests', 'tumblelog', 'demo.xml'), 'r')
+        self.xmlString = f.read()
+        f.close()
+        self.cache = tumblr.MemoryCache()
+
+    def testSameContent(self):
+        """Unchanged content isn't parsed again."""
+        log = tumblr.parse(self.xmlString, parse_cache=self.cache)
+        assert tumblr.parse(self.xmlString, parse_cache=self.cache).posts is log.posts
+
+    def testResponseNotShared(self):
+        """A cached Tumblelog comes back as a copy with its own response."""
+        client = tumblr.Client(cache=None, parse_cache=self.cache)
+        url = local_server() + '/api/read'
+        log = tumblr.parse(url, client=client)
+        other = tumblr.parse(url, client=client)
+        assert other is not log and other.posts is log.posts
+        assert other.http_response is not log.http_response
+        assert other.etag == log.etag
+
+    def testDiskCache(self):
+        """A DiskCache keeps parsed results in the dumps() format."""
+        directory = tempfile.mkdtemp()
+        try:
+            cache = tumblr.DiskCache(directory)
+            log = tumblr.parse(self.xmlString, parse_cache=cache)
+            assert len(os.listdir(directory)) == 1
+            other = tumblr.parse(self.xmlString, parse_cache=cache)
+            assert other is not log
+            assert [ p.id for p in other.posts ] == [ p.id for p in log.posts ]
+        finally:
+            shutil.rmtree(directory)
+
+    def testChangedContent(self):
+        """Changed content is parsed again."""
+        log = tumblr.parse(self.xmlString, parse_cache=self.cache)
+        changed = self.xmlString.replace('Untitled', 'Titled')
+        assert tumblr.parse(changed, parse_cache=self.cache).title == u'Titled'
+
+    def testOptionsInKey(self):
+        """Results parsed with other options aren't reused."""
+        log = tumblr.parse(self.xmlString, parse_cache=self.cache)
+        assert tumblr.parse(self.xmlString, parse_cache=self.cache, lazy=True).posts is not log.posts
+
+    def testValidatorKey(self):
+        """Responses are identified by URL and validator."""
+        resp = { 'etag': '"abc"' }
+        key = tumblr._parseCacheKey('http://demo.tumblr.com/api/read', resp, 'x')
+        assert isinstance(key, str)
+        assert key == tumblr._parseCacheKey('http://demo.tumblr.com/api/read', resp, 'y')
+        assert key != tumblr._parseCacheKey('http://demo.tumblr.com/api/read', { 'etag': '"def"' }, 'x')
+
+    def testClientParseCache(self):
+        """A Client's parse cache is used by default."""
+        client = tumblr.Client(cache=None, parse_cache=self.cache)
+        log = client.parse(self.xmlString)
+        assert client.parse(self.xmlString).posts is log.posts
+
+
+class PostTypesTestCase(unittest.TestCase):
+    """Tests the post type registry."""
+    def setUp(self):
+        f = open(os.path.join(os.getcwd(), 'tests', 'tumblelog', 'demo.xml'), 'r')
+        self.xmlString = f.read()
+        f.close()
+        self.saved = tumblr.POST_TYPES.copy()
+
+    def tearDown(self):
+        tumblr.POST_TYPES.clear()
+        tumblr.POST_TYPES.update(self.saved)
+
+    def testTypesFilter(self):
+        """Only posts of the requested types are parsed."""
+        log = tumblr.parse(self.xmlString, types=[ 'photo', 'link' ])
+        assert [ p.type for p in log.posts ] == [ 'photo', 'link' ]
+
+    def testIterparseTypesFilter(self):
+        """The incremental parser can also skip post types."""
+        posts = list(tumblr.iterparse(self.xmlString, types=[ 'quote' ]))[1:]
+        assert [ p.type for p in posts ] == [ 'quote' ]
+
+    def testSkippedPostsNotBuilt(self):
+        """Skipped posts are never turned into objects."""
+        built = []
+        def regular(postdata, lazy):
+            built.append(postdata)
+            return tumblr.Regular(postdata, lazy)
+        tumblr.register_post_type('regular', regular)
+        tumblr.parse(self.xmlString, types=[ 'photo' ])
+        assert built == []
+        tumblr.parse(self.xmlString)
+        assert len(built) == 1
+
+    def testUnknownType(self):
+        """Posts of unknown types become plain Post objects."""
+        del tumblr.POST_TYPES['quote']
+        post = tumblr.parse(self.xmlString).posts[0]
+        assert type(post) is tumblr.Post and post.type == 'unknown'
+
+
+class ColumnsTestCase(unittest.TestCase):
+    """Tests exporting posts column by column."""
+    def setUp(self):
+        self.path = os.path.join(os.getcwd(), 'tests', 'tumblelog', 'demo.xml')
+        self.log = tumblr.parse(self.path)
+
+    def testColumns(self):
+        """Each column holds one field of every post."""
+        columns = tumblr.to_columns(self.log)
+        assert len(columns) == len(self.log.posts)
+        assert list(columns['id']) == [ p.id for p in self.log.posts ]
+        assert list(columns['unixtime']) == [ p.unixtime for p in self.log.posts ]
+        assert columns['url'] == [ p.url for p in self.log.posts ]
+
+    def testCategorical(self):
+        """The type column holds codes into its categories."""
+        columns = tumblr.to_columns(self.log)
+        categories = columns.categories['type']
+        assert [ categories[c] for c in columns['type'] ] == [ p.type for p in self.log.posts ]
+        assert len(categories) == len(set(categories))
+
+    def testMissingFields(self):
+        """Posts without a field get None in its column."""
+        columns = tumblr.to_columns(self.log, ('id', 'link_url'))
+        for post, link_url in zip(self.log.posts, columns['link_url']):
+            assert link_url == getattr(post, 'link_url', None)
+
+    def testPages(self):
+        """Pages and iterparse() output can be exported alike."""
+        pages = tumblr.to_columns([ self.log, self.log ])
+        assert list(pages['id']) == [ p.id for p in self.log.posts ] * 2
+        items = tumblr.to_columns(tumblr.iterparse(self.path))
+        assert list(items['id']) == [ p.id for p in self.log.posts ]
+
+    def testNumpy(self):
+        """Columns can be turned into NumPy arrays."""
+        try:
+            import numpy
+        except ImportError:
+            return
+        arrays = tumblr.to_columns(self.log).to_numpy()
+        assert arrays['id'].tolist() == [ p.id for p in self.log.posts ]
+
+
+class PostStoreTestCase(unittest.TestCase):
+    """Tests storing posts and querying them offline."""
+    def setUp(self):
+        self.log = tumblr.parse(os.path.join(os.getcwd(), 'tests', 'tumblelog', 'sourcefeeds.xml'))
+        self.store = tumblr.PostStore()
+        self.store.add(self.log)
+
+    def tearDown(self):
+        self.store.close()
+
+    def testQuery(self):
+        """Stored posts come back as the same Post subclasses, newest first."""
+        posts = self.store.query(self.log.name)
+        assert len(posts) == len(self.log.posts) == len(self.store)
+        assert [ p.unixtime for p in posts ] == sorted([ p.unixtime for p in self.log.posts ], reverse=True)
+        for post in posts:
+            original = [ p for p in self.log.posts if p.id == post.id ][0]
+            assert type(post) is type(original) and post.url == original.url
+            assert post.postdata is None
+
+    def testFilters(self):
+        """Queries can be narrowed by type, time and source feed."""
+        posts = self.log.posts
+        for type in set([ p.type for p in posts ]):
+            assert self.store.count(types=type) == len([ p for p in posts if p.type == type ])
+        middle = sorted([ p.unixtime for p in posts ])[len(posts) // 2]
+        assert self.store.count(since=middle) == len([ p for p in posts if p.unixtime >= middle ])
+        assert self.store.count(until=middle) == len([ p for p in posts if p.unixtime < middle ])
+        fed = [ p for p in posts if p.source_feed_id is not None ]
+        assert [ p.id for p in self.store.query(source_feed_id=fed[0].source_feed_id) ] == \
+            [ p.id for p in posts if p.source_feed_id == fed[0].source_feed_id ]
+        assert self.store.count('nobody') == 0
+        assert len(self.store.query(limit=2)) == 2
+
+    def testReplace(self):
+        """Adding a post again replaces it."""
+        self.store.add(self.log)
+        assert len(self.store) == len(self.log.posts)
+        post = self.log.posts[0]
+        assert self.store.get(self.log.name, post.id).id == post.id
+        assert self.store.get(self.log.name, -1) is None
+        assert self.store.high_water_mark(self.log.name) == max([ p.id for p in self.log.posts ])
+
+    def testHighWaterMark(self):
+        """A high water mark given to add() counts even without its post."""
+        highest = max([ p.id for p in self.log.posts ])
+        self.store.add(self.log.name, [], highest + 10)
+        assert self.store.high_water_mark(self.log.name) == highest + 10
+        self.store.add(self.log.name, [], highest - 10)
+        assert self.store.high_water_mark(self.log.name) == highest + 10
+        self.store.add('other', [], 5)
+        assert self.store.high_water_mark('other') == 5 and self.store.high_water_mark('nobody') is None
+
+    def testStoredFormat(self):
+        """Posts are stored in the dumps() format rather than pickled."""
+        row = self.store._db.execute("SELECT post FROM posts").fetchone()
+        assert str(row[0]).startswith(tumblr.SERIAL_MAGIC)
+
+    def testFile(self):
+        """A store on disk keeps its posts between uses."""
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'posts.db')
+            store = tumblr.PostStore(path)
+            store.add(self.log)
+            store.close()
+            store = tumblr.PostStore(path)
+            assert len(store) == len(self.log.posts)
+            store.close()
+        finally:
+            shutil.rmtree(directory)
+
+
+class SearchIndexTestCase(unittest.TestCase):
+    """Tests full-text search over posts."""
+    def setUp(self):
+        self.log = tumblr.parse(os.path.join(os.getcwd(), 'tests', 'tumblelog', 'demo.xml'))
+        self.index = tumblr.SearchIndex()
+        self.index.add(self.log)
+
+    def testWords(self):
+        """Posts containing every word are found, whatever their case."""
+        assert self.index.search('Lorem ipsum') == [ 232 ]
+        assert self.index.search('you') == [ 236, 233 ]
+        assert self.index.search('nonexistent') == []
+
+    def testHtmlStripped(self):
+        """Tags aren't indexed, but the text inside them is."""
+        assert self.index.search('href') == []
+        assert self.index.search('fischinger') == [ 235 ]
+
+    def testBoolean(self):
+        """Queries can use OR, NOT, - and parentheses."""
+        assert self.index.search('confucius OR fischinger') == [ 236, 235 ]
+        assert self.index.search('you NOT confucius') == [ 233 ]
+        assert self.index.search('you -confucius') == [ 233 ]
+        assert self.index.search('(confucius OR vaccuums) you') == [ 236, 233 ]
+        assert self.index.search('-you') == [ 235, 234, 232 ]
+
+    def testPhrase(self):
+        """Quoted phrases must appear word for word."""
+        assert self.index.search('"slow you go"') == [ 236 ]
+        assert self.index.search('"go you slow"') == []
+
+    def testReplace(self):
+        """Adding a post again replaces what was indexed for it."""
+        self.index.add(self.log.posts[0])
+        assert len(self.index) == 5 and self.index.search('confucius') == [ 236 ]
+        self.index.remove(236)
+        assert self.index.search('confucius') == [] and 236 not in self.index
+
+    def testSaveLoad(self):
+        """An index can be saved and loaded again."""
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'index')
+            self.index.save(path)
+            index = tumblr.SearchIndex.load(path)
+            assert len(index) == 5
+            assert index.search('"lorem ipsum" OR confucius') == [ 236, 232 ]
+        finally:
+            shutil.rmtree(directory)
+
+    def testBadQuery(self):
+        """Unbalanced parentheses and empty clauses raise TumblrError."""
+        self.assertRaises(tumblr.TumblrError, self.index.search, '(you')
+        self.assertRaises(tumblr.TumblrError, self.index.search, 'you)')
+        self.assertRaises(tumblr.TumblrError, self.index.search, 'confucius OR')
+        self.assertRaises(tumblr.TumblrError, self.index.search, 'OR confucius')
+        self.assertRaises(tumblr.TumblrError, self.index.search, 'confucius ()')
+
+    def testLoadBadFile(self):
+        """Loading a file that isn't a saved index raises TumblrParseError."""
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'index')
+            f = open(path, 'wb')
+            f.write(zlib.compress(tumblr.dumps([ 1, 2, 3 ])))
+            f.close()
+            self.assertRaises(tumblr.TumblrParseError, tumblr.SearchIndex.load, path)
+            f = open(path, 'wb')
+            f.write('not an index')
+            f.close()
+            self.assertRaises(tumblr.TumblrParseError, tumblr.SearchIndex.load, path)
+        finally:
+            shutil.rmtree(directory)
+
+
+class SerializationTestCase(unittest.TestCase):
+    """Tests the compact binary serialization."""
+    def setUp(self):
+        self.log = tumblr.parse(os.path.join(os.getcwd(), 'tests', 'tumblelog', 'sourcefeeds.xml'))
+
+    def assertSamePosts(self, posts, others):
+        assert len(posts) == len(others)
+        for post, other in zip(posts, others):
+            assert type(post) is type(other)
+            state = tumblr._Compact.__getstate__(post)
+            state.pop('postdata')
+            for name, value in state.items():
+                if name == 'lines':
+                    assert [ l.__getstate__() for l in getattr(other, name) ] == \
+                        [ l.__getstate__() for l in value ]
+                elif name != 'source_feed':
+                    assert getattr(other, name) == value, name
+            assert other.postdata is None
+
+    def testTumblelog(self):
+        """A Tumblelog comes back with its posts and feeds."""
+        log = tumblr.loads(tumblr.dumps(self.log))
+        assert isinstance(log, tumblr.Tumblelog)
+        assert (log.name, log.url, log.num_posts) == (self.log.name, self.log.url, self.log.num_posts)
+        assert sorted(log.feeds) == sorted(self.log.feeds)
+        assert log.http_response is None
+        self.assertSamePosts(self.log.posts, log.posts)
+        # Shared objects stay shared
+        post = log.posts[3]
+        assert post.source_feed is log.feeds[post.source_feed_id]
+
+    def testEveryPostType(self):
+        """Every post type and conversation lines survive a round trip."""
+        log = tumblr.parse(os.path.join(os.getcwd(), 'tests', 'tumblelog', 'demo.xml'), lazy=True)
+        posts = tumblr.loads(tumblr.dumps(log.posts))
+        self.assertSamePosts(log.posts, posts)
+        conversation = [ p for p in posts if p.type == 'conversation' ][0]
+        assert isinstance(conversation.lines[0], tumblr.Line)
+
+    def testAuthInfo(self):
+        """AuthInfo objects can be serialized."""
+        resp, authinfo = tumblr.authenticate('guido@example.com', 'secret', client=tumblr.Client(cache=None),
+                                             base_url=local_server() + '/api/authenticate')
+        other = tumblr.loads(tumblr.dumps(authinfo))
+        assert other.user.liked_post_count == authinfo.user.liked_post_count
+        assert [ t.private_id for t in other.tumblelogs ] == [ t.private_id for t in authinfo.tumblelogs ]
+
+    def testSmallerThanPickle(self):
+        """Repeated strings make a page much smaller than a pickle."""
+        import cPickle
+        from tumblrbench import generate_page
+        log = tumblr.parse(generate_page(100), keep_postdata=False)
+        assert len(tumblr.dumps(log)) * 2 < len(cPickle.dumps(log, 2))
+
+    def testBadData(self):
+        """Data that can't be read raises TumblrParseError."""
+        data = tumblr.dumps(self.log)
+        for bad in ('', 'junk', data[:len(data) // 2], data[:4] + '\x7f' + data[5:]):
+            self.assertRaises(tumblr.TumblrParseError, tumblr.loads, bad)
+
+    def testCorruptData(self):
+        """Corrupt data raises nothing but TumblrParseError."""
+        import random
+        data = tumblr.dumps(self.log)
+        rand = random.Random(24)
+        for i in range(2000):
+            offset = rand.randrange(len(data))
+            bad = data[:offset] + chr(rand.randrange(256)) + data[offset + 1:]
+            try:
+                tumblr.loads(bad)
+            except tumblr.TumblrParseError:
+                pass
+        # Lists nested far past the recursion limit
+        encoder = tumblr._Encoder()
+        encoder.tags = [ 'l' ] * 5000 + [ 'N' ]
+        encoder.u32s = [ 1 ] * 5000
+        self.assertRaises(tumblr.TumblrParseError, tumblr.loads, encoder.getvalue())
+
+    def testUnsupportedObject(self):
+        """Objects of other classes, and integers over 64 bits, can't be serialized."""
+        self.assertRaises(TypeError, tumblr.dumps, [ object() ])
+        self.assertRaises(TypeError, tumblr.dumps, 2 ** 70)
+        assert tumblr.loads(tumblr.dumps(-2 ** 63)) == -2 ** 63
+
+
+class ImportTestCase(unittest.TestCase):
+    """Tests what importing the module costs."""
+    def testNoNetworkStack(self):
+        """Importing and parsing local XML doesn't load the network stack."""
+        import sys
+        import subprocess
+        script = ("import sys, tumblr; tumblr.parse(%r); "
+                  "print ' '.join([ m for m in ('httplib2', 'httplib', 'socket', 'urllib', 'threading') "
+                  "if m in sys.modules ])") % os.path.join(os.getcwd(), 'tests', 'tumblelog', 'demo.xml')
+        p = subprocess.Popen([ sys.executable, '-c', script ], stdout=subprocess.PIPE)
+        loaded = p.communicate()[0].strip()
+        assert p.returncode == 0 and loaded == '', loaded
+
+    def testParseWhileImporting(self):
+        """Worker threads can parse while the main thread is still importing."""
+        import sys
+        import subprocess
+        directory = tempfile.mkdtemp()
+        try:
+            f = open(os.path.join(directory, 'importsparse.py'), 'w')
+            f.write("import tumblr\n"
+                    "c = tumblr.Client(cache=None, parse_cache=tumblr.MemoryCache())\n"
+                    "log = list(tumblr.parse_many([%r], client=c))[0]\n"
+                    % os.path.join(os.getcwd(), 'tests', 'tumblelog', 'demo.xml'))
+            f.close()
+            env = dict(os.environ)
+            env['PYTHONPATH'] = os.pathsep.join([ os.getcwd(), directory ])
+            p = subprocess.Popen([ sys.executable, '-c', 'import importsparse' ], env=env)
+            deadline = time.time() + 30
+            while p.poll() is None and time.time() < deadline:
+                time.sleep(0.1)
+            if p.poll() is None:
+                p.kill()
+                p.wait()
+                self.fail("Parsing at import time deadlocked")
+            assert p.returncode == 0
+        finally:
+            shutil.rmtree(directory)
+
+
+class ParseFilesTestCase(unittest.TestCase):
+    """Tests parsing files in a pool of processes."""
+    def setUp(self):
+        tests = os.path.join(os.getcwd(), 'tests')
+        self.paths = [ os.path.join(tests, 'tumblelog', name + '.xml') 
+                       for name in ('demo', 'link', 'sourcefeeds') ]
+        self.paths.append(os.path.join(tests, 'xml', 'ampersand.xml'))
+
+    def testInOrder(self):
+        """Results come back in the order the files were given."""
+        results = list(tumblr.parse_files(self.paths, processes=2, chunksize=1))
+        assert [ path for path, result in results ] == self.paths
+        for path, result in results[:3]:
+            f = open(path, 'r')
+            log = tumblr.parse(f)
+            f.close()
+            assert [ p.id for p in result.posts ] == [ p.id for p in log.posts ]
+            assert [ p.content for p in result.posts ] == [ p.content for p in log.posts ]
+        assert isinstance(results[3][1], tumblr.TumblrParseError)
+
+    def testSourceFeedsShared(self):
+        """Posts still share the Feed objects of their tumblelog."""
+        path, log = list(tumblr.parse_files(self.paths[2:3], processes=1))[0]
+        assert log.posts[3].source_feed is log.feeds[48612]
+
+    def testLazyPostsPickled(self):
+        """Lazy posts are pickled with every field, and without postdata."""
+        import pickle
+        f = open(self.paths[0], 'r')
+        log = tumblr.parse(f, lazy=True)
+        f.close()
+        regular = pickle.loads(pickle.dumps(log.posts[4], 2))
+        assert regular.postdata is None
+        assert regular.body == log.posts[4].body
+
+
+class ClientTestCase(unittest.TestCase):
+    """Tests the reusable Client."""
+    def setUp(self):
+        self.client = tumblr.Client(cache=None)
+        self.filename = os.path.join(os.getcwd(), 'tests', 'file', 'golden.xml')
+
+    def testConnectionsReused(self):
+        """The same thread always gets the same connections."""
+        assert self.client._http() is self.client._http()
+
+    def testConnectionsPerThread(self):
+        """Each thread gets its own connections."""
+        others = []
+        t = threading.Thread(target=lambda: others.append(self.client._http()))
+        t.start()
+        t.join()
+        assert others[0] is not self.client._http()
+
+    def testParse(self):
+        """A Client can be used to parse."""
+        f = open(self.filename, 'r')
+        log = self.client.parse(f)
+        f.close()
+        assert log.title == 'golden hours'
+
+    def testClose(self):
+        """Closing a Client drops its connections."""
+        self.client._http()
+        self.client.close()
+        assert len(self.client._http().connections) == 0
+
+
+class AsyncTestCase(unittest.TestCase):
+    """Tests parsing in the background."""
+    def setUp(self):
+        self.client = tumblr.Client(cache=None, max_per_host=2, workers=2)
+        f = open(os.path.join(os.getcwd(), 'tests', 'tumblelog', 'demo.xml'), 'r')
+        self.xmlString = f.read()
+        f.close()
+
+    def testSameResult(self):
+        """Parsing in the background gives the same posts as parse()."""
+        log = self.client.parse_async(self.xmlString).get(10)
+        assert [ p.id for p in log.posts ] == [ p.id for p in tumblr.parse(self.xmlString).posts ]
+
+    def testCallback(self):
+        """The callback is handed the finished result."""
+        done = []
+        result = self.client.parse_async(self.xmlString, lambda r: done.append(r))
+        result.wait(10)
+        assert done == [ result ]
+
+    def testCallbackFinishesFirst(self):
+        """wait() returns only once the callback has finished, and get() 
+        works within the callback."""
+        done = []
+        def callback(r):
+            time.sleep(0.1)
+            done.append(r.get())
+        result = self.client.parse_async(self.xmlString, callback)
+        log = result.get(10)
+        assert done == [ log ]
+
+    def testFailingCallback(self):
+        """A callback that raises is logged, and the worker carries on."""
+        import logging
+        records = []
+        handler = logging.Handler()
+        handler.emit = records.append
+        log = logging.getLogger('tumblr')
+        log.addHandler(handler)
+        try:
+            def callback(r):
+                raise ValueError("broken callback")
+            self.client.parse_async(self.xmlString, callback).wait(10)
+            # The failure is logged just after the result is marked ready
+            deadline = time.time() + 10
+            while not records and time.time() < deadline:
+                time.sleep(0.01)
+            for n in range(self.client._pool.workers):
+                assert self.client.parse_async(self.xmlString).get(10).name == u'demo'
+        finally:
+            log.removeHandler(handler)
+        assert len(records) == 1 and records[0].exc_info[0] is ValueError
+
+    def testErrorRaisedByGet(self):
+        """Exceptions are raised again by AsyncResult.get()."""
+        result = self.client.parse_async('<tumblr>')
+        try:
+            result.get(10)
+        except tumblr.TumblrParseError:
+            pass
+        else:
+            self.fail("Expected a TumblrParseError!")
+
+    def testHostSemaphore(self):
+        """Requests to one host share a single limit."""
+        a = self.client._hostSemaphore('http://demo.tumblr.com/api/read')
+        b = self.client._hostSemaphore('http://demo.tumblr.com/api/read?start=50')
+        c = self.client._hostSemaphore('http://golden.cpl593h.net/api/read')
+        assert a is b and a is not c
+
+
+class ReadUrlTestCase(unittest.TestCase):
+    """Tests building read API URLs."""
+    def testName(self):
+        """A tumblelog name is turned into its read API URL."""
+        assert tumblr.ReadUrl("demo").url == "http://demo.tumblr.com/api/read"
+
+    def testUrl(self):
+        """A read API URL is used as is."""
+        url = tumblr.ReadUrl("http://www.example.com/api/read").set_start(50).url
+        assert url == "http://www.example.com/api/read?start=50"
+
+    def testUrlWithQuery(self):
+        """Parameters are merged into a query the URL already has."""
+        url = tumblr.ReadUrl("http://x.com/api/read?type=photo&start=0").set_start(50).url
+        assert url == "http://x.com/api/read?type=photo&start=50"
+
+
+class PaginationTestCase(unittest.TestCase):
+    """Tests the helpers behind fetch_all()."""
+    def setUp(self):
+        self.filename = os.path.join(os.getcwd(), 'tests', 'tumblelog', 'demo.xml')
+        f = open(self.filename, 'r')
+        self.log = tumblr.parse(f)
+        f.close()
+
+    def testThreadedOrder(self):
+        """Every result comes back along with its index."""
+        results = list(tumblr._threaded(lambda n: n * 2, range(20), 4, tumblr._WorkerPool(4)))
+        assert sorted([ (i, r) for i, r, e in results ]) == [ (i, i * 2) for i in range(20) ]
+
+    def testThreadedErrors(self):
+        """Errors are returned rather than raised."""
+        results = list(tumblr._threaded(lambda n: 1 / n, [ 0, 1 ], 2, tumblr._WorkerPool(2)))
+        errors = [ e for i, r, e in results if e is not None ]
+        assert len(errors) == 1 and isinstance(errors[0], ZeroDivisionError)
+
+    def testThreadedStopsWhenClosed(self):
+        """No more calls are started once the caller stops iterating."""
+        calls = []
+        def call(n):
+            calls.append(n)
+            time.sleep(0.05)
+            return n
+        results = tumblr._threaded(call, range(20), 2, tumblr._WorkerPool(2))
+        results.next()
+        results.close()
+        time.sleep(0.3)
+        assert len(calls) <= 3, calls
+
+    def testMergeDeduplicates(self):
+        """Posts repeated across pages are only kept once."""
+        posts = tumblr._mergePosts([ self.log, self.log ])
+        assert [ p.id for p in posts ] == [ p.id for p in self.log.posts ]
+
+
 class ContentTypeParserTestCase(unittest.TestCase):
     """Tests the simple HTTP Content-Type parser."""
     def testContentTypeAndCharset(self):
@@ -230,6 +1114,487 @@ class NetworkingTestCase(unittest.TestCase):
         else:
             self.fail("Expected an UnsupportedContentTypeError!")
 
+class LocalNetworkingTestCase(unittest.TestCase):
+    """Checks various network conditions against a local stand-in server."""
+    def setUp(self):
+        self.base = local_server()
+        self.client = tumblr.Client(cache=None)
+        self.urlRedirectDestination = self.base + '/http/redirects/demo.xml'
+
+    def parse(self, path):
+        return tumblr.parse(self.base + path, client=self.client)
+
+    def assertParseRaises(self, path, error):
+        try:
+            self.parse(path)
+        except error:
+            pass
+        else:
+            self.fail("Expected a %s!" % error.__name__)
+
+    def testRead(self):
+        """A tumblelog can be read from the local server."""
+        log = self.parse('/api/read')
+        assert log.name == u'demo' and len(log.posts) == 5
+
+    def testRedirects(self):
+        """Redirects via HTTP 301, 302 and 307 are recorded."""
+        for status in (301, 302, 307):
+            log = self.parse('/http/redirects/%d' % status)
+            assert log.http_response.previous.status == status
+            assert log.http_response['content-location'] == self.urlRedirectDestination
+
+    def testErrors(self):
+        """HTTP errors raise the matching exceptions."""
+        self.assertParseRaises('/http/errors/403', tumblr.URLForbiddenError)
+        self.assertParseRaises('/http/errors/404', tumblr.URLNotFoundError)
+        self.assertParseRaises('/http/errors/410', tumblr.URLGoneError)
+        self.assertParseRaises('/http/errors/500', tumblr.InternalServerError)
+        self.assertParseRaises('/http/errors/503', tumblr.ServiceUnavailableError)
+
+    def testContentTypes(self):
+        """XML content types are accepted and others aren't."""
+        assert self.parse('/http/contenttype/?type=textxml').name == u'demo'
+        assert self.parse('/http/contenttype/?type=applicationxml').name == u'demo'
+        self.assertParseRaises('/http/contenttype/?type=applicationxhtmlxml', tumblr.UnsupportedContentTypeError)
+
+    def testMalformedXML(self):
+        """Error thrown if XML is not well-formed."""
+        self.assertParseRaises('/xml/malformed.xml', tumblr.TumblrParseError)
+
+    def testAuthenticate(self):
+        """Authentication info is parsed."""
+        resp, authinfo = tumblr.authenticate('guido@example.com', 'secret', client=self.client, 
+                                             base_url=self.base + '/api/authenticate')
+        assert authinfo.user.liked_post_count == 12
+        assert [ t.is_primary for t in authinfo.tumblelogs ] == [ True, False ]
+        assert authinfo.tumblelogs[1].private_id == 123456
+
+    def testAuthenticateForbidden(self):
+        """Error thrown if the password is wrong."""
+        try:
+            tumblr.authenticate('guido@example.com', 'wrong', client=self.client, 
+                                base_url=self.base + '/api/authenticate')
+        except tumblr.URLForbiddenError:
+            pass
+        else:
+            self.fail("Expected a URLForbiddenError!")
+
+    def testFetchAll(self):
+        """Every page of a tumblelog is fetched."""
+        log = tumblr.fetch_all(self.base + '/generated-120/api/read', num=50, client=self.client)
+        assert [ p.id for p in log.posts ] == range(120, 0, -1)
+
+    def testFetchAllLargePages(self):
+        """Asking for more posts per page than the API returns doesn't skip any."""
+        urls = []
+        listener = lambda event, data: event == 'fetch' and urls.append(data['url'])
+        tumblr.add_listener(listener)
+        try:
+            log = tumblr.fetch_all(self.base + '/generated-120/api/read', num=100, client=self.client)
+        finally:
+            tumblr.remove_listener(listener)
+        assert [ p.id for p in log.posts ] == range(120, 0, -1)
+        assert len(urls) == 3 and not [ u for u in urls if 'num=50' not in u ]
+
+    def testStore(self):
+        """fetch_all() and sync() add their posts to a store."""
+        store = tumblr.PostStore()
+        tumblr.fetch_all(self.base + '/generated-120/api/read', num=50, client=self.client, store=store)
+        assert len(store) == 120 and store.high_water_mark('demo') == 120
+        store = tumblr.PostStore()
+        tumblr.sync(self.base + '/generated-120/api/read', 100, client=self.client, store=store)
+        assert sorted([ p.id for p in store.query('demo') ]) == range(101, 121)
+
+    def testStoreFilteredSync(self):
+        """A sync of some types of post still moves the store's high water mark."""
+        store = tumblr.PostStore()
+        posts, mark = tumblr.sync(self.base + '/generated-120/api/read', 100, client=self.client, 
+                                  types=['nonexistent'], store=store)
+        assert posts == [] and len(store) == 0
+        assert mark == store.high_water_mark('demo') == 120
+
+    def testConcurrentClients(self):
+        """The server answers many requests at once."""
+        client = tumblr.Client(cache=None, workers=8)
+        results = [ client.parse_async(self.base + '/api/read?latency=0.1') for i in range(16) ]
+        for result in results:
+            assert result.get(10).name == u'demo'
+
+
+class SyncTestCase(unittest.TestCase):
+    """Tests fetching only the posts newer than a known id."""
+    def setUp(self):
+        self.url = local_server() + '/generated-120/api/read'
+        self.client = tumblr.Client(cache=None)
+        self.urls = []
+        self.listener = lambda event, data: event == 'fetch' and self.urls.append(data['url'])
+        tumblr.add_listener(self.listener)
+
+    def tearDown(self):
+        tumblr.remove_listener(self.listener)
+
+    def testNewer(self):
+        """Only posts newer than since_id are returned, streamed or not."""
+        for stream in (False, True):
+            posts, mark = tumblr.sync(self.url, 65, num=20, client=self.client, stream=stream)
+            assert [ p.id for p in posts ] == range(120, 65, -1)
+            assert mark == 120
+            posts, mark = tumblr.sync(self.url, 120, client=self.client, stream=stream)
+            assert posts == [] and mark == 120
+
+    def testStopsAtBoundary(self):
+        """No pages past the one holding since_id are fetched."""
+        posts, mark = tumblr.sync(self.url, 100, num=10, client=self.client)
+        assert [ p.id for p in posts ] == range(120, 100, -1)
+        assert len(self.urls) == 3
+
+    def testEverything(self):
+        """With no since_id, every post is fetched."""
+        posts, mark = tumblr.sync(self.url, num=50, client=self.client)
+        assert [ p.id for p in posts ] == range(120, 0, -1)
+        assert mark == 120
+
+    def testLargePages(self):
+        """Asking for more posts per page than the API returns doesn't stop 
+        paging early."""
+        posts, mark = tumblr.sync(self.url, num=100, client=self.client)
+        assert [ p.id for p in posts ] == range(120, 0, -1)
+        assert len(self.urls) == 3 and not [ u for u in self.urls if 'num=50' not in u ]
+
+    def testTypes(self):
+        """Only posts of the given types are returned, but all of them count 
+        towards the high water mark."""
+        posts, mark = tumblr.sync(self.url, 60, num=50, client=self.client, types=[ 'quote' ])
+        assert posts and set([ p.type for p in posts ]) == set([ 'quote' ])
+        assert min([ p.id for p in posts ]) > 60
+        assert mark == 120
+
+    def testUrlWithQuery(self):
+        """Pages of a read URL with a query of its own are fetched properly."""
+        posts, mark = tumblr.sync(self.url + '?type=quote', num=10, client=self.client)
+        assert len(posts) == 24 and set([ p.type for p in posts ]) == set([ 'quote' ])
+        assert len(self.urls) == 3
+
+
+class ConditionalGetTestCase(unittest.TestCase):
+    """Tests polling with stored validators."""
+    def setUp(self):
+        self.url = local_server() + '/api/read'
+        self.client = tumblr.Client(cache=None)
+
+    def testValidators(self):
+        """A parsed tumblelog carries its response's validators."""
+        log = tumblr.parse(self.url, client=self.client)
+        assert log.etag == log.http_response['etag']
+        assert log.last_modified == log.http_response['last-modified']
+        assert not log.not_modified
+
+    def testNoValidatorsForStrings(self):
+        """XML that didn't come from a URL has no validators."""
+        log = tumblr.parse(open(os.path.join(os.getcwd(), 'tests', 'tumblelog', 'demo.xml')).read())
+        assert log.etag is None and log.last_modified is None
+
+    def testNotModified(self):
+        """A matching ETag gives a NotModified rather than a Tumblelog."""
+        log = tumblr.parse(self.url, client=self.client)
+        result = tumblr.parse(self.url, client=self.client, etag=log.etag)
+        assert isinstance(result, tumblr.NotModified) and result.not_modified
+        assert result.http_response.status == 304
+        assert result.etag == log.etag
+
+    def testNotModifiedSince(self):
+        """A matching Last-Modified gives a NotModified too."""
+        log = tumblr.parse(self.url, client=self.client)
+        result = self.client.parse(self.url, last_modified=log.last_modified)
+        assert result.not_modified and result.last_modified == log.last_modified
+
+    def testModified(self):
+        """A stale ETag gives a freshly parsed Tumblelog."""
+        log = tumblr.parse(self.url, client=self.client, etag='"stale"')
+        assert not log.not_modified and len(log.posts) == 5
+        assert log.etag != '"stale"'
+
+    def testHttpCache(self):
+        """A 304 answered from httplib2's own cache is still not modified."""
+        client = tumblr.Client(cache=tumblr.MemoryCache())
+        log = tumblr.parse(self.url, client=client)
+        assert tumblr.parse(self.url, client=client, etag=log.etag).not_modified
+
+
+class StreamTestCase(unittest.TestCase):
+    """Tests streaming responses into the parser."""
+    def setUp(self):
+        self.base = local_server()
+        self.client = tumblr.Client(cache=None)
+
+    def testStreamParse(self):
+        """A streamed response parses the same as a buffered one."""
+        url = self.base + '/generated-120/api/read?num=120'
+        log = tumblr.parse(url, client=self.client, stream=True)
+        assert [ p.id for p in log.posts ] == range(120, 0, -1)
+        assert log.etag == log.http_response['etag']
+
+    def testStreamParseCache(self):
+        """Streamed responses are closed, and not read, on a parse cache hit."""
+        client = tumblr.Client(cache=None, max_per_host=1, parse_cache=tumblr.MemoryCache())
+        url = self.base + '/api/read'
+        sizes = []
+        listener = lambda event, data: event == 'body' and sizes.append(data['bytes'])
+        results = []
+        def work():
+            for i in range(3):
+                results.append(tumblr.parse(url, client=client, stream=True))
+        tumblr.add_listener(listener)
+        try:
+            t = threading.Thread(target=work)
+            t.setDaemon(True)
+            t.start()
+            t.join(10)
+        finally:
+            tumblr.remove_listener(listener)
+        # Each parse gave its host slot back for the next one
+        assert [ len(log.posts) for log in results ] == [ 5, 5, 5 ]
+        assert sizes[0] > 0 and sizes[1:] == [ 0, 0 ]
+
+    def testRedirects(self):
+        """Streamed requests follow redirects."""
+        log = tumblr.parse(self.base + '/http/redirects/301', client=self.client, stream=True)
+        assert log.http_response.previous.status == 301
+        assert log.http_response['content-location'] == self.base + '/http/redirects/demo.xml'
+
+    def testErrors(self):
+        """HTTP errors raise the usual exceptions when streaming."""
+        try:
+            tumblr.parse(self.base + '/http/errors/404', client=self.client, stream=True)
+        except tumblr.URLNotFoundError:
+            pass
+        else:
+            self.fail("Expected a URLNotFoundError!")
+
+    def testNotModified(self):
+        """Conditional requests work when streaming."""
+        url = self.base + '/api/read'
+        log = tumblr.parse(url, client=self.client, stream=True)
+        assert tumblr.parse(url, client=self.client, stream=True, etag=log.etag).not_modified
+
+    def testMaxBytes(self):
+        """A response over max_bytes raises ResponseTooLargeError."""
+        client = tumblr.Client(cache=None, max_bytes=1024)
+        for stream in (True, False):
+            try:
+                tumblr.parse(self.base + '/api/read', client=client, stream=stream)
+            except tumblr.ResponseTooLargeError:
+                pass
+            else:
+                self.fail("Expected a ResponseTooLargeError!")
+
+    def testMaxBytesKeepAlive(self):
+        """A client that gave up on a large response can still be used."""
+        client = tumblr.Client(cache=None, max_bytes=16 * 1024)
+        url = self.base + '/generated-2000/api/read'
+        self.assertRaises(tumblr.ResponseTooLargeError, tumblr.parse, url + '?num=2000', client=client)
+        assert [ p.id for p in tumblr.parse(url + '?num=1', client=client).posts ] == [ 2000 ]
+
+    def testTimeout(self):
+        """A response slower than the timeout raises TumblrTimeoutError."""
+        client = tumblr.Client(cache=None, timeout=0.1)
+        for stream in (True, False):
+            try:
+                tumblr.parse(self.base + '/api/read?latency=0.5', client=client, stream=stream)
+            except tumblr.TumblrTimeoutError:
+                pass
+            else:
+                self.fail("Expected a TumblrTimeoutError!")
+
+    def testMaxPosts(self):
+        """iterparse stops reading once it has yielded max_posts posts."""
+        url = self.base + '/generated-2000/api/read?num=2000'
+        client = tumblr.Client(cache=None, max_bytes=64 * 1024)
+        items = list(tumblr.iterparse(url, client=client, stream=True, max_posts=10))
+        assert [ p.id for p in items[1:] ] == range(2000, 1990, -1)
+        # The whole page is far over the limit, so it was never read
+        self.assertRaises(tumblr.ResponseTooLargeError, tumblr.parse, url, client=client, stream=True)
+
+
+class RetryTestCase(unittest.TestCase):
+    """Tests retrying failed requests and limiting their rate."""
+    def setUp(self):
+        self.base = local_server()
+
+    def testRetrySucceeds(self):
+        """A request that fails a few times is retried until it succeeds."""
+        client = tumblr.Client(cache=None, retries=2, backoff=0.01)
+        log = client.parse(self.base + '/api/read?fail=2&retry=succeeds')
+        assert log.name == u'demo'
+
+    def testRetriesRunOut(self):
+        """The error is raised once the retries run out."""
+        client = tumblr.Client(cache=None, retries=1, backoff=0.01)
+        try:
+            client.parse(self.base + '/api/read?fail=2&retry=runsout')
+        except tumblr.ServiceUnavailableError:
+            pass
+        else:
+            self.fail("Expected a ServiceUnavailableError!")
+
+    def testTooManyRequests(self):
+        """HTTP 429 raises a TooManyRequestsError."""
+        client = tumblr.Client(cache=None)
+        try:
+            client.parse(self.base + '/http/errors/429')
+        except tumblr.TooManyRequestsError:
+            pass
+        else:
+            self.fail("Expected a TooManyRequestsError!")
+
+    def testRetryAfter(self):
+        """The wait asked for by Retry-After is used."""
+        client = tumblr.Client(cache=None, max_backoff=5)
+        assert client._retryDelay(0, { 'retry-after': '3' }) == 3
+        assert client._retryDelay(0, { 'retry-after': '120' }) is None
+        assert tumblr._retryAfter({ 'retry-after': 'Thu, 01 Jan 1970 00:00:00 GMT' }) == 0
+        assert tumblr._retryAfter({ 'retry-after': 'soon' }) is None
+
+    def testRetryAfterTooLong(self):
+        """A Retry-After longer than max_backoff isn't waited for."""
+        client = tumblr.Client(cache=None, retries=2, max_backoff=5)
+        start = time.time()
+        self.assertRaises(tumblr.ServiceUnavailableError, client.parse, 
+                          self.base + '/api/read?fail=1&retry_after=120&retry=toolong')
+        assert time.time() - start < 5
+
+    def testPostNotRetried(self):
+        """Requests that aren't idempotent aren't retried."""
+        client = tumblr.Client(cache=None, retries=2, backoff=0.01)
+        self.assertRaises(tumblr.ServiceUnavailableError, tumblr.authenticate, 'guido@example.com', 'secret', 
+                          client=client, base_url=self.base + '/api/authenticate?fail=1&retry=post')
+
+    def testBackoffGrows(self):
+        """Without Retry-After, the wait is bounded by a growing backoff."""
+        client = tumblr.Client(cache=None, backoff=1, max_backoff=60)
+        for attempt in range(5):
+            assert 0 <= client._retryDelay(attempt, {}) <= 2 ** attempt
+
+    def testRateLimiter(self):
+        """Requests to a host are spaced out to the given rate."""
+        limiter = tumblr.RateLimiter(50)
+        start = time.time()
+        for i in range(6):
+            limiter.acquire('demo.tumblr.com')
+        limiter.acquire('golden.cpl593h.net')
+        assert time.time() - start >= 0.09
+
+
+class ParseManyTestCase(unittest.TestCase):
+    """Tests parsing many tumblelogs at once."""
+    def setUp(self):
+        self.base = local_server()
+        self.client = tumblr.Client(cache=None)
+        self.urls = [ self.base + '/api/read?latency=0.05',
+                      self.base + '/sourcefeeds/api/read',
+                      self.base + '/http/errors/404',
+                      self.base + '/xml/malformed.xml' ]
+
+    def testResults(self):
+        """Every URL gets a result, and failures don't stop the others."""
+        results = dict(tumblr.parse_many(self.urls, concurrency=4, client=self.client))
+        assert sorted(results.keys()) == sorted(self.urls)
+        assert results[self.urls[0]].name == u'demo'
+        assert results[self.urls[1]].posts[3].source_feed.id == 48612
+        assert isinstance(results[self.urls[2]], tumblr.URLNotFoundError)
+        assert isinstance(results[self.urls[3]], tumblr.TumblrParseError)
+
+    def testProgress(self):
+        """The progress callback is called once per URL."""
+        calls = []
+        for url, result in tumblr.parse_many(self.urls, 2, lambda *args: calls.append(args), client=self.client):
+            pass
+        assert [ c[0] for c in calls ] == [ 1, 2, 3, 4 ]
+        assert sorted([ c[2] for c in calls ]) == sorted(self.urls)
+        assert [ c[1] for c in calls ] == [ 4 ] * 4
+
+    def testClientThreads(self):
+        """The work runs on the client's own threads, call after call, so 
+        their kept-alive connections are reused."""
+        urls = [ self.base + '/api/read' ] * 6
+        threads = set()
+        def progress(done, total, url, result):
+            assert isinstance(result, tumblr.Tumblelog), result
+        for n in range(2):
+            for url, result in tumblr.parse_many(urls, 4, progress, client=self.client):
+                pass
+            threads.update(self.client._pool._threads)
+        assert len(threads) == self.client._pool.workers
+
+
+class InstrumentationTestCase(unittest.TestCase):
+    """Tests instrumentation listeners."""
+    def setUp(self):
+        self.url = local_server() + '/api/read'
+        self.events = []
+        self.listener = lambda event, data: self.events.append((event, data))
+        tumblr.add_listener(self.listener)
+
+    def tearDown(self):
+        tumblr.remove_listener(self.listener)
+
+    def names(self):
+        return [ event for event, data in self.events ]
+
+    def testParse(self):
+        """Parsing a URL reports each stage."""
+        client = tumblr.Client(cache=None, parse_cache=tumblr.MemoryCache())
+        log = tumblr.parse(self.url, client=client)
+        assert self.names() == [ 'fetch', 'cache', 'tree', 'posts', 'parse' ]
+        data = dict(self.events)
+        assert data['fetch']['status'] == 200 and data['fetch']['bytes'] > 0
+        assert data['cache']['hit'] is False
+        assert sum(data['posts']['counts'].values()) == len(log.posts)
+        assert data['parse']['url'] == self.url and data['parse']['hit'] is False
+        del self.events[:]
+        tumblr.parse(self.url, client=client)
+        assert self.names() == [ 'fetch', 'cache', 'parse' ]
+        assert self.events[1][1]['hit'] and self.events[2][1]['hit']
+
+    def testNotModified(self):
+        """A Not Modified response is reported as a parse hit."""
+        client = tumblr.Client(cache=None)
+        log = tumblr.parse(self.url, client=client)
+        del self.events[:]
+        assert tumblr.parse(self.url, client=client, etag=log.etag).not_modified
+        assert self.names() == [ 'fetch', 'parse' ] and self.events[1][1]['hit']
+
+    def testBrokenListener(self):
+        """A listener that raises doesn't stop parsing or other listeners."""
+        def broken(event, data):
+            raise ValueError, "broken"
+        tumblr.remove_listener(self.listener)
+        tumblr.add_listener(broken)
+        tumblr.add_listener(self.listener)
+        try:
+            log = tumblr.parse(os.path.join(os.getcwd(), 'tests', 'tumblelog', 'demo.xml'))
+        finally:
+            tumblr.remove_listener(broken)
+        assert len(log.posts) == 5
+        assert self.names() == [ 'tree', 'posts', 'parse' ]
+
+    def testStream(self):
+        """Streaming reports the connection and the body."""
+        posts = list(tumblr.iterparse(self.url, client=tumblr.Client(cache=None), stream=True))
+        assert self.names() == [ 'connect', 'fetch', 'body', 'posts' ]
+        data = dict(self.events)
+        assert data['fetch']['stream'] and data['fetch']['bytes'] is None
+        assert data['body']['bytes'] > 0
+        assert sum(data['posts']['counts'].values()) == len(posts) - 1
+
+    def testRemove(self):
+        """Removed listeners aren't called."""
+        tumblr.remove_listener(self.listener)
+        tumblr.parse(os.path.join(os.getcwd(), 'tests', 'tumblelog', 'demo.xml'))
+        assert self.events == []
+
+
 class XMLTestCases(unittest.TestCase):
     """Checks various XML handling scenarios."""
     def setUp(self):